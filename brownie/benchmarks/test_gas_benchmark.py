@@ -0,0 +1,165 @@
+from scripts.helpers import smart_get_account, get_contract, fund_link, LOCAL_BLOCKCHAIN_ENVIRONMENTS
+from brownie import network, accounts, config, chain, web3, CharityRaffle
+import csv
+import json
+import os
+import time
+import pytest
+
+# Gas and latency benchmarks for every CharityRaffle entry point, run with `brownie test benchmarks`
+# The results are written to reports/benchmark.json and reports/benchmark.csv and compared against benchmarks/baseline.json
+# Every configuration is compared against its baseline entry as soon as it has run, so the checks don't depend on the test order
+# A configuration without a baseline entry is skipped (its results are still reported)
+# Set BENCHMARK_UPDATE_BASELINE=1 to store the current results as the new baseline (the configurations that ran are updated)
+# Set BENCHMARK_TOLERANCE to the fraction of extra gas allowed before a regression fails (default 0)
+
+ticketPrice = 0.001*10**18
+length = 60
+exp_time = 120
+
+BUYERS = [1, 10, 50]
+TICKETS_PER_BUYER = [1, 10]
+NAME_LENGTHS = [8, 256]
+
+REPORT_DIR = "reports"
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+def config_key(buyers, ticketsPerBuyer, nameLength):
+    return "buyers={} tickets={} name={}".format(buyers, ticketsPerBuyer, nameLength)
+
+def timed(send):
+    start = time.perf_counter()
+    tx = send()
+    tx.wait(1)
+    return tx, time.perf_counter() - start
+
+def record(rows, key, function, tx, latency):
+    rows.append({"config": key, "function": function, "gas": tx.gas_used, "latency": round(latency, 4)})
+
+@pytest.fixture(scope="module", autouse=True)
+def local_only():
+    if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        pytest.skip("The benchmarks run against the local development network and mocks")
+
+def load_baseline():
+    if not os.path.exists(BASELINE_PATH):
+        return {}
+    with open(BASELINE_PATH) as f:
+        return json.load(f)
+
+# Collects the results of every benchmark that ran, the report (and the baseline when updating it) is written once they are done
+@pytest.fixture(scope="session")
+def benchmark_results():
+    rows = []
+    yield rows
+    if not rows:
+        return
+    summary = summarize(rows)
+    write_report(summary)
+    if os.environ.get("BENCHMARK_UPDATE_BASELINE"):
+        baseline = load_baseline()
+        baseline.update(summary)
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+
+@pytest.fixture(scope="module")
+def buyers():
+    # Extra accounts so the number of unique buyers isn't capped by the local accounts
+    extra = [accounts.add() for _ in range(max(BUYERS))]
+    for account in extra:
+        smart_get_account(0).transfer(account, ticketPrice * max(TICKETS_PER_BUYER) * 2)
+    return extra
+
+@pytest.fixture(scope="module")
+def raffle():
+    return CharityRaffle.deploy(
+        exp_time,
+        get_contract("vrf_coordinator").address,
+        get_contract("link_token").address,
+        config["networks"][network.show_active()]["fee"],
+        config["networks"][network.show_active()]["keyhash"],
+        {'from': smart_get_account(0)},
+    )
+
+@pytest.mark.parametrize("nameLength", NAME_LENGTHS)
+@pytest.mark.parametrize("ticketsPerBuyer", TICKETS_PER_BUYER)
+@pytest.mark.parametrize("buyerCount", BUYERS)
+def test_benchmark(raffle, buyers, benchmark_results, buyerCount, ticketsPerBuyer, nameLength):
+    key = config_key(buyerCount, ticketsPerBuyer, nameLength)
+    rows = []
+    owner = smart_get_account(0)
+    chain.snapshot()
+    # CreateRaffle
+    tx, latency = timed(lambda: raffle.CreateRaffle("x" * nameLength, ticketPrice, length, {'from': owner}))
+    record(rows, key, "CreateRaffle", tx, latency)
+    raffleId = tx.events['RaffleCreated']['raffleId']
+    # BuyTickets, overpaying by 1 wei so there is change to collect
+    for buyer in buyers[:buyerCount]:
+        tx, latency = timed(lambda: raffle.BuyTickets(raffleId, ticketsPerBuyer, {'from': buyer, 'value': ticketPrice*ticketsPerBuyer + 1}))
+        record(rows, key, "BuyTickets", tx, latency)
+    # CollectChange
+    tx, latency = timed(lambda: raffle.CollectChange({'from': owner}))
+    record(rows, key, "CollectChange", tx, latency)
+    chain.sleep(length)
+    chain.mine()
+    # brownie only keeps one snapshot, so the claim is undone with a nested one straight from the node
+    claimSnapshot = web3.provider.make_request("evm_snapshot", [])["result"]
+    # ClaimRaffle and fulfillRandomness through the mock coordinator
+    fund_link(raffle.address, account=owner)
+    tx, latency = timed(lambda: raffle.ClaimRaffle(raffleId, {'from': owner}))
+    record(rows, key, "ClaimRaffle", tx, latency)
+    requestId = tx.events['RequestRandomness']['requestId']
+    tx, latency = timed(lambda: get_contract("vrf_coordinator").callBackWithRandomness(requestId, buyerCount*ticketsPerBuyer - 1, raffle.address, {'from': owner}))
+    record(rows, key, "fulfillRandomness", tx, latency)
+    assert "WinnerChosen" in tx.events
+    # TicketRefund, from before the claim once the raffle has expired
+    web3.provider.make_request("evm_revert", [claimSnapshot])
+    chain.sleep(exp_time)
+    chain.mine()
+    tx, latency = timed(lambda: raffle.TicketRefund(raffleId, {'from': buyers[0]}))
+    record(rows, key, "TicketRefund", tx, latency)
+    tx, latency = timed(lambda: raffle.Withdraw({'from': buyers[0]}))
+    record(rows, key, "Withdraw", tx, latency)
+    chain.revert()
+    benchmark_results.extend(rows)
+    # Only the gas is compared since the latency depends on the machine
+    if not os.environ.get("BENCHMARK_UPDATE_BASELINE"):
+        assert_no_regression(key, summarize(rows)[key], load_baseline())
+
+def summarize(rows):
+    summary = {}
+    for row in rows:
+        entry = summary.setdefault(row["config"], {}).setdefault(row["function"], {"calls": 0, "gas": 0, "max_gas": 0, "latency": 0})
+        entry["calls"] += 1
+        entry["gas"] += row["gas"]
+        entry["max_gas"] = max(entry["max_gas"], row["gas"])
+        entry["latency"] += row["latency"]
+    for functions in summary.values():
+        for entry in functions.values():
+            entry["avg_gas"] = entry.pop("gas") // entry["calls"]
+            entry["avg_latency"] = round(entry.pop("latency") / entry["calls"], 4)
+    return summary
+
+def write_report(summary):
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    with open(os.path.join(REPORT_DIR, "benchmark.json"), "w") as f:
+        json.dump(summary, f, indent=2, sort_keys=True)
+    with open(os.path.join(REPORT_DIR, "benchmark.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["config", "function", "calls", "avg_gas", "max_gas", "avg_latency"])
+        for key in sorted(summary):
+            for function in sorted(summary[key]):
+                entry = summary[key][function]
+                writer.writerow([key, function, entry["calls"], entry["avg_gas"], entry["max_gas"], entry["avg_latency"]])
+
+def assert_no_regression(key, functions, baseline):
+    # The results are still in the report, the configuration just has nothing to be compared with yet
+    if key not in baseline:
+        pytest.skip("No baseline for {}, run with BENCHMARK_UPDATE_BASELINE=1 and commit benchmarks/baseline.json".format(key))
+    tolerance = float(os.environ.get("BENCHMARK_TOLERANCE", 0))
+    regressions = []
+    for function, entry in baseline[key].items():
+        current = functions.get(function)
+        if current and current["max_gas"] > entry["max_gas"] * (1 + tolerance):
+            regressions.append("{} {}: {} -> {} gas".format(key, function, entry["max_gas"], current["max_gas"]))
+    assert not regressions, "Gas regressions:\n" + "\n".join(regressions)
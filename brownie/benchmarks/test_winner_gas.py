@@ -0,0 +1,66 @@
+from scripts.helpers import smart_get_account, get_contract, fund_link, LOCAL_BLOCKCHAIN_ENVIRONMENTS
+from brownie import network, accounts, config, chain, web3, CharityRaffle
+import pytest
+
+# Checks that the VRF callback gas stays flat with 10,000 unique buyers, run with `brownie test benchmarks`
+# Buying 10,000 tickets takes minutes, so it lives here instead of the main test suite (which runs a small version)
+
+ticketPrice = 0.001*10**18
+exp_time = 120
+BUYERS = [10, 10000]
+
+@pytest.fixture(scope="module", autouse=True)
+def local_only():
+    if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        pytest.skip("Buying 10,000 tickets is only practical on a local chain")
+
+@pytest.fixture(scope="module")
+def buyers():
+    # Fresh accounts, so each raffle has as many unique buyers as purchases (the local accounts would cap it at 10)
+    extra = [accounts.add() for _ in range(max(BUYERS))]
+    for account in extra:
+        smart_get_account(0).transfer(account, ticketPrice * len(BUYERS) + len(BUYERS) * 300000 * web3.eth.gas_price)
+    return extra
+
+@pytest.fixture(scope="module")
+def raffle():
+    return CharityRaffle.deploy(
+        exp_time,
+        get_contract("vrf_coordinator").address,
+        get_contract("link_token").address,
+        config["networks"][network.show_active()]["fee"],
+        config["networks"][network.show_active()]["keyhash"],
+        {'from': smart_get_account(0)},
+    )
+
+def test_winner_selection_gas_is_flat(raffle, buyers):
+    # Arrange
+    long_length = 60*60*24 # Long enough to fit all the purchases
+    callback_gas = {}
+    chain.snapshot()
+    for raffleId, count in enumerate(BUYERS, start=1):
+        createTx = raffle.CreateRaffle("Test Raffle " + str(count), ticketPrice, long_length, {'from': smart_get_account(0)})
+        createTx.wait(1)
+        for account in buyers[:count]:
+            raffle.BuyTickets(raffleId, 1, {'from': account, 'value': ticketPrice})
+    chain.sleep(long_length)
+    chain.mine()
+    # Act
+    for raffleId, count in enumerate(BUYERS, start=1):
+        fund_link(raffle.address, account=smart_get_account(0))
+        claimTx = raffle.ClaimRaffle(raffleId, {'from': smart_get_account(0)})
+        claimTx.wait(1)
+        requestId = claimTx.events['RequestRandomness']['requestId']
+        # The last ticket, the worst case for a walk over the owners
+        callTx = get_contract("vrf_coordinator").callBackWithRandomness(requestId, count-1, raffle.address, {'from': smart_get_account(0)})
+        callTx.wait(1)
+        callback_gas[count] = callTx.gas_used
+        # The mock swallows a failed callback, so check that the winner was set
+        Dname, Dbeneficiary, Dwinner, DstartTime, DendTime = raffle.GetRaffleInfo(raffleId)
+        assert Dwinner == buyers[count-1].address
+    chain.revert()
+    # Assert
+    print("Callback gas", callback_gas)
+    assert callback_gas[10000] < 206000 # The gas limit enforced by the VRF coordinator
+    # The old walk read two storage slots per owner, 9,990 more owners would have cost about 42 million more gas
+    assert callback_gas[10000] - callback_gas[10] < 40000
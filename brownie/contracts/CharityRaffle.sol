@@ -4,6 +4,8 @@ pragma solidity ^0.8.0;
 
 import "@openzeppelin/contracts/access/Ownable.sol";
 import "@openzeppelin/contracts/utils/Counters.sol";
+import "@openzeppelin/contracts/utils/math/SafeCast.sol";
+import "@openzeppelin/contracts/utils/cryptography/MerkleProof.sol";
 import "@chainlink/contracts/src/v0.8/dev/VRFConsumerBase.sol";
 import "@openzeppelin/contracts/token/ERC20/IERC20.sol";
 
@@ -25,6 +27,11 @@ contract CharityRaffle is Ownable, VRFConsumerBase {
     event RequestRandomness(bytes32 requestId);
     event WinnerChosen(uint256 raffleId, address payable winner, uint256 ticketIndex);
     event RaffleCreated(address beneficiary, uint256 raffleId);
+    event RaffleMetadata(uint256 raffleId, bytes32 nameHash, string name);
+    event TicketsPurchased(uint256 raffleId, address buyer, uint256 ticketCount);
+    event TicketsRefunded(uint256 raffleId, address buyer, uint256 ticketCount, uint256 amount);
+    event Withdrawal(address account, uint256 amount);
+    event TicketRootSet(uint256 raffleId, bytes32 root);
 
     enum RaffleState {
         Open,
@@ -34,22 +41,49 @@ contract CharityRaffle is Ownable, VRFConsumerBase {
     }
     // Open: The raffle is open for entry
     // SelectingWinner: The raffle is closed and the winner is being selected
-    // Finished: The raffle is finished and the winner has been selected, beneficiary has been paid
+    // Finished: The raffle is finished and the winner has been selected, beneficiary has been credited the raffle money
     // Expired: The raffle has expired since the benificiary has not ended it
 
+    struct TicketRange {
+        address owner; // address that bought this block of tickets
+        uint96 end; // cumulative ticket count once this purchase was made (exclusive end of the range)
+    }
+
+    // Packed so that creating a raffle writes 4 slots:
+    // slot 0: beneficiary, startTime, state, paidOut
+    // slot 1: winner, endTime
+    // slot 2: ticketCount, ticketPrice
+    // slot 3: nameHash (only for raffles made with CreateRaffleWithMetadata)
+    // slot 4: name (plus more slots for names over 31 bytes, empty for raffles made with CreateRaffleWithMetadata)
     struct Raffle {
-        uint256 id; // unique identifier for the raffle
-        string name; // name of the raffle
-        uint256 ticketCount; // number of tickets bought for this raffle
-        uint256 ticketPrice; // in wei
         address payable beneficiary; // address of the beneficiary
-        address payable winner; // address of the winner of the raffle, by default it's 0x0
-        uint256 startTime; // unix timestamp of the start of the raffle
-        uint256 endTime; // unix timestamp of the end of the raffle
+        uint64 startTime; // unix timestamp of the start of the raffle
         RaffleState state; // state of the raffle
+        bool paidOut; // whether the raffle money has been credited to the beneficiary
+        address payable winner; // address of the winner of the raffle, by default it's 0x0
+        uint64 endTime; // unix timestamp of the end of the raffle
+        uint128 ticketCount; // number of tickets bought for this raffle
+        uint128 ticketPrice; // in wei
+        bytes32 nameHash; // keccak256 of the name, the name itself is only in the RaffleMetadata event
+        string name; // name of the raffle
         mapping(address => uint256) ticketBalances; // mapping of address to ticket count
         address[] ticketOwners; // array of addresses of the ticket owners (used for iteration through the ticket balances)
-        bool paidOut; // whether the raffle has been payed out
+        TicketRange[] ticketRanges; // append-only list of ticket ranges, one per purchase (used for the binary search of the winner)
+    }
+
+    // A flat copy of a raffle's public fields, used to read many raffles in a single call
+    struct RaffleSummary {
+        uint256 id;
+        string name;
+        address beneficiary;
+        address winner;
+        uint256 startTime;
+        uint256 endTime;
+        uint256 ticketCount;
+        uint256 ticketPrice;
+        RaffleState state;
+        bool paidOut;
+        bytes32 nameHash;
     }
 
     // Some rules of how raffles work
@@ -59,39 +93,166 @@ contract CharityRaffle is Ownable, VRFConsumerBase {
     // 4. The beneficiary can only end the raffle after the end time
 
     Counters.Counter public RaffleCount;
-    mapping(uint256 => Raffle) public Raffles; // mapping of raffle id to raffle data
+    mapping(uint256 => Raffle) internal raffles; // mapping of raffle id to raffle data, read through Raffles()
     mapping(bytes32 => uint256) public VRFRequestIdTORaffleId; // mapping of VRF request id to raffle id
 
     // A value that keeps track of all the change givent to the contract
     uint256 public change = 0;
 
+    // The refunds and raffle payouts each address can collect with Withdraw
+    mapping(address => uint256) public pendingWithdrawals;
+
+    // Merkle roots of the ticket ranges of closed raffles, built off-chain by scripts/ticket_snapshot.py
+    // A leaf is keccak256(abi.encodePacked(owner, start, end)) for a range holding the tickets start to end (exclusive)
+    mapping(uint256 => bytes32) public ticketRoots;
+
     function CreateRaffle(string memory _raffleName, uint256 _ticketPrice, uint256 _raffleLength) public returns(uint256 raffleId){
+        Raffle storage raffle = _createRaffle(_ticketPrice, _raffleLength);
+        raffle.name = _raffleName;
+    }
+
+    // Stores only the hash of the name so the gas doesn't depend on how long it is, the full name is emitted in RaffleMetadata
+    // Names of these raffles read back as empty strings, get them from the event (see scripts/indexer.py)
+    function CreateRaffleWithMetadata(string calldata _raffleName, uint256 _ticketPrice, uint256 _raffleLength) public returns(uint256 raffleId){
+        Raffle storage raffle = _createRaffle(_ticketPrice, _raffleLength);
+        raffle.nameHash = keccak256(bytes(_raffleName));
+        emit RaffleMetadata(RaffleCount.current(), raffle.nameHash, _raffleName);
+    }
+
+    function _createRaffle(uint256 _ticketPrice, uint256 _raffleLength) internal returns (Raffle storage raffle) {
         RaffleCount.increment();
         uint256 _id = RaffleCount.current();
-        Raffle storage raffle = Raffles[_id]; 
-        raffle.id = _id;
-        raffle.name = _raffleName;
-        raffle.ticketCount = 0;
-        raffle.ticketPrice = _ticketPrice;
+        raffle = raffles[_id];
+        raffle.ticketPrice = SafeCast.toUint128(_ticketPrice);
         raffle.beneficiary = payable(msg.sender);
-        raffle.startTime = block.timestamp;
-        raffle.endTime = block.timestamp + _raffleLength;
-        raffle.state = RaffleState.Open;
-        raffle.winner = payable(0x0);
+        raffle.startTime = SafeCast.toUint64(block.timestamp);
+        raffle.endTime = SafeCast.toUint64(block.timestamp + _raffleLength);
+        raffle.state = RaffleState.Open; // Written even though it's the zero value, the slot may have been touched before the raffle existed
+        // The ticket count, winner and paidOut all start at their zero values
         emit RaffleCreated(raffle.beneficiary, _id);
     }
 
     // Some reader functions for getting info about raffles
+    // Same values as the old public getter of the raffles mapping, the id is 0 for raffles that don't exist
+    function Raffles(uint256 _id) public view returns (uint256 id, string memory name, uint256 ticketCount, uint256 ticketPrice, address payable beneficiary, address payable winner, uint256 startTime, uint256 endTime, RaffleState state, bool paidOut) {
+        Raffle storage raffle = raffles[_id];
+        if (raffle.startTime != 0) {
+            id = _id;
+        }
+        name = raffle.name;
+        ticketCount = raffle.ticketCount;
+        ticketPrice = raffle.ticketPrice;
+        beneficiary = raffle.beneficiary;
+        winner = raffle.winner;
+        startTime = raffle.startTime;
+        endTime = raffle.endTime;
+        state = raffle.state;
+        paidOut = raffle.paidOut;
+    }
+
     function GetRaffleInfo(uint256 _id) public view returns (string memory name, address payable beneficiary, address payable winner, uint256 startTime, uint256 endTime) {
-        return (Raffles[_id].name, Raffles[_id].beneficiary, Raffles[_id].winner, Raffles[_id].startTime, Raffles[_id].endTime);
+        return (raffles[_id].name, raffles[_id].beneficiary, raffles[_id].winner, raffles[_id].startTime, raffles[_id].endTime);
     }
 
     function GetRaffleTicketInfo(uint256 _id) public view returns (string memory name, uint256 startTime, uint256 endTime, uint256 ticketCount, uint256 ticketPrice) {
-        return (Raffles[_id].name, Raffles[_id].startTime, Raffles[_id].endTime, Raffles[_id].ticketCount, Raffles[_id].ticketPrice);
+        return (raffles[_id].name, raffles[_id].startTime, raffles[_id].endTime, raffles[_id].ticketCount, raffles[_id].ticketPrice);
+    }
+
+    // The hash of the name for raffles made with CreateRaffleWithMetadata, 0 for the others
+    function GetRaffleNameHash(uint256 _id) public view returns (bytes32) {
+        return raffles[_id].nameHash;
+    }
+
+    // Reads up to limit raffles starting at offset (offset 0 is the raffle with id 1)
+    function GetRafflesPage(uint256 offset, uint256 limit) public view returns (RaffleSummary[] memory page) {
+        uint256 count = RaffleCount.current();
+        if (offset >= count) {
+            return new RaffleSummary[](0);
+        }
+        if (limit > count - offset) {
+            limit = count - offset;
+        }
+        page = new RaffleSummary[](limit);
+        for (uint256 i = 0; i < limit; i++) {
+            uint256 _id = offset + i + 1;
+            Raffle storage raffle = raffles[_id];
+            page[i] = RaffleSummary(_id, raffle.name, raffle.beneficiary, raffle.winner, raffle.startTime, raffle.endTime, raffle.ticketCount, raffle.ticketPrice, raffle.state, raffle.paidOut, raffle.nameHash);
+        }
     }
 
     function GetRaffleBalance(uint256 _id, address owner) public view returns (uint256 balance) {
-        return Raffles[_id].ticketBalances[owner];
+        return raffles[_id].ticketBalances[owner];
+    }
+
+    // Reads the ticket balances of many addresses in a single call
+    function GetRaffleBalances(uint256 _id, address[] calldata owners) public view returns (uint256[] memory balances) {
+        balances = new uint256[](owners.length);
+        for (uint256 i = 0; i < owners.length; i++) {
+            balances[i] = raffles[_id].ticketBalances[owners[i]];
+        }
+    }
+
+    // Reads up to limit ticket owners of a raffle starting at offset, along with their balances
+    function GetRaffleHoldersPage(uint256 _id, uint256 offset, uint256 limit) public view returns (address[] memory owners, uint256[] memory balances) {
+        address[] storage ticketOwners = raffles[_id].ticketOwners;
+        if (offset >= ticketOwners.length) {
+            return (new address[](0), new uint256[](0));
+        }
+        if (limit > ticketOwners.length - offset) {
+            limit = ticketOwners.length - offset;
+        }
+        owners = new address[](limit);
+        balances = new uint256[](limit);
+        for (uint256 i = 0; i < limit; i++) {
+            owners[i] = ticketOwners[offset + i];
+            balances[i] = raffles[_id].ticketBalances[owners[i]];
+        }
+    }
+
+    function GetRaffleHolderCount(uint256 _id) public view returns (uint256) {
+        return raffles[_id].ticketOwners.length;
+    }
+
+    // Reads up to limit ticket ranges of a raffle starting at offset, one per purchase in the order they were made
+    // A range holds the tickets from the end of the range before it (0 for the first one) up to its end (exclusive)
+    function GetTicketRangesPage(uint256 _id, uint256 offset, uint256 limit) public view returns (address[] memory owners, uint256[] memory ends) {
+        TicketRange[] storage ranges = raffles[_id].ticketRanges;
+        if (offset >= ranges.length) {
+            return (new address[](0), new uint256[](0));
+        }
+        if (limit > ranges.length - offset) {
+            limit = ranges.length - offset;
+        }
+        owners = new address[](limit);
+        ends = new uint256[](limit);
+        for (uint256 i = 0; i < limit; i++) {
+            owners[i] = ranges[offset + i].owner;
+            ends[i] = ranges[offset + i].end;
+        }
+    }
+
+    function GetTicketRangeCount(uint256 _id) public view returns (uint256) {
+        return raffles[_id].ticketRanges.length;
+    }
+
+    // Stores the root of a raffle's ticket ranges once no more tickets can be bought, it can only be set once
+    function SetTicketRoot(uint256 _id, bytes32 _root) public onlyOwner {
+        require(_id > 0 && _id <= RaffleCount.current(), "The raffle does not exist");
+        require(block.timestamp >= raffles[_id].endTime, "The raffle has not closed yet");
+        require(ticketRoots[_id] == bytes32(0), "The ticket root has already been set");
+        require(_root != bytes32(0), "The ticket root can't be empty");
+        ticketRoots[_id] = _root;
+        emit TicketRootSet(_id, _root);
+    }
+
+    // Checks that the ticket is in the range start to end (exclusive) owned by owner, with a proof against the stored root
+    // Lets a WinnerChosen result be checked with log(purchases) hashes instead of reading every purchase
+    function VerifyTicketProof(uint256 _id, uint256 _ticketIndex, address owner, uint256 start, uint256 end, bytes32[] calldata proof) public view returns (bool) {
+        require(ticketRoots[_id] != bytes32(0), "The ticket root has not been set");
+        if (_ticketIndex < start || _ticketIndex >= end) {
+            return false;
+        }
+        return MerkleProof.verify(proof, ticketRoots[_id], keccak256(abi.encodePacked(owner, start, end)));
     }
 
     function GetRaffleCount() public view returns (uint256) {
@@ -99,12 +260,12 @@ contract CharityRaffle is Ownable, VRFConsumerBase {
     }
 
     function ClaimRaffle(uint256 _id) public{
-        require(msg.sender == Raffles[_id].beneficiary, "Only the beneficiary can claim the raffle");
-        require(block.timestamp >= Raffles[_id].endTime, "The raffle has not closed yet");
-        require(Raffles[_id].endTime + expirationPeriod > block.timestamp, "The raffle has expired and cannot be claimed");
-        require(Raffles[_id].state == RaffleState.Open, "The raffle is not avaible for claiming");
+        require(msg.sender == raffles[_id].beneficiary, "Only the beneficiary can claim the raffle");
+        require(block.timestamp >= raffles[_id].endTime, "The raffle has not closed yet");
+        require(raffles[_id].endTime + expirationPeriod > block.timestamp, "The raffle has expired and cannot be claimed");
+        require(raffles[_id].state == RaffleState.Open, "The raffle is not avaible for claiming");
         require(IERC20(linkTokenAddress).balanceOf(address(this)) >=  linkFee, "The contract needs to be paid link token to claim the raffle");
-        Raffles[_id].state = RaffleState.SelectingWinner;
+        raffles[_id].state = RaffleState.SelectingWinner;
         // Fire off the VRF to select the winner
         bytes32 requestId = requestRandomness(VRFKeyHash, linkFee); // Return a bytes 32 which is the request ID
         VRFRequestIdTORaffleId[requestId] = _id; // Map the request ID to the raffle ID
@@ -114,39 +275,64 @@ contract CharityRaffle is Ownable, VRFConsumerBase {
     // This is run by the VRF coordinator to finalize the winner
     function fulfillRandomness(bytes32 _requestId, uint256 _randomness) internal override {
         uint256 raffleId = VRFRequestIdTORaffleId[_requestId];
-        require(Raffles[raffleId].state == RaffleState.SelectingWinner, "The raffle is not in the SelectingWinner state");
+        require(raffles[raffleId].state == RaffleState.SelectingWinner, "The raffle is not in the SelectingWinner state");
         require(_randomness >= 0, "No randomness found");
-        Raffles[raffleId].state = RaffleState.Finished;
-        uint256 winningTicketIndex = _randomness % Raffles[raffleId].ticketCount;
-        // Todo: Convert the winning ticket index to an address
-        uint256 ticketCounter = 0;
-        uint256 l = Raffles[raffleId].ticketOwners.length;
-        for (uint256 i = 0; i < l; i++) {
-            uint256 balance = Raffles[raffleId].ticketBalances[Raffles[raffleId].ticketOwners[i]];
-            if (ticketCounter <= winningTicketIndex && winningTicketIndex < ticketCounter + balance) { // We have found the winning ticket
-                Raffles[raffleId].winner = payable(Raffles[raffleId].ticketOwners[i]);
-                break;
+        raffles[raffleId].state = RaffleState.Finished;
+        uint256 winningTicketIndex = _randomness % raffles[raffleId].ticketCount;
+        raffles[raffleId].winner = payable(_findTicketOwner(raffleId, winningTicketIndex));
+        // Credit the raffle money to the beneficiary, they collect it with Withdraw so the callback never sends ether
+        pendingWithdrawals[raffles[raffleId].beneficiary] += uint256(raffles[raffleId].ticketPrice) * raffles[raffleId].ticketCount;
+        raffles[raffleId].paidOut = true;
+        emit WinnerChosen(raffleId, raffles[raffleId].winner, winningTicketIndex);
+    }
+
+    // Binary search over the ticket ranges for the one holding the ticket, so the VRF callback gas only grows with log(purchases)
+    function _findTicketOwner(uint256 _id, uint256 _ticketIndex) internal view returns (address) {
+        TicketRange[] storage ranges = raffles[_id].ticketRanges;
+        uint256 low = 0;
+        uint256 high = ranges.length - 1;
+        while (low < high) {
+            uint256 mid = (low + high) / 2;
+            if (ranges[mid].end > _ticketIndex) {
+                high = mid;
+            } else {
+                low = mid + 1;
             }
-            ticketCounter += balance;
         }
-        // Send the raffle money to the beneficiary
-        (Raffles[raffleId].paidOut, ) = payable(Raffles[raffleId].beneficiary).call{value: Raffles[raffleId].ticketPrice * Raffles[raffleId].ticketCount}("");
-        emit WinnerChosen(raffleId, Raffles[raffleId].winner, winningTicketIndex);
+        return ranges[low].owner;
     }
 
     // A function to buy tickets for a raffle
     function BuyTickets(uint256 raffleId, uint256 _ticketCount) public payable {
-        require(Raffles[raffleId].state == RaffleState.Open, "Raffle not open");
-        require(block.timestamp < Raffles[raffleId].endTime, "Raffle is closed");
+        uint256 cost = _buyTickets(raffleId, _ticketCount);
+        require(msg.value >= cost, "Ticket price is greater than the amount sent");
+        change += msg.value - cost;
+    }
+
+    // A function to buy tickets for multiple raffles in a single transaction, the value sent must cover all of the tickets
+    function BuyTicketsBatch(uint256[] calldata raffleIds, uint256[] calldata _ticketCounts) public payable {
+        require(raffleIds.length == _ticketCounts.length, "Raffle ids and ticket counts must be the same length");
+        uint256 cost = 0;
+        for (uint256 i = 0; i < raffleIds.length; i++) {
+            cost += _buyTickets(raffleIds[i], _ticketCounts[i]);
+        }
+        require(msg.value >= cost, "Ticket price is greater than the amount sent");
+        change += msg.value - cost;
+    }
+
+    // Records the tickets for the buyer and returns how much they cost, the caller has to check the payment
+    function _buyTickets(uint256 raffleId, uint256 _ticketCount) internal returns (uint256 cost) {
+        require(raffles[raffleId].state == RaffleState.Open, "Raffle not open");
+        require(block.timestamp < raffles[raffleId].endTime, "Raffle is closed");
         require(_ticketCount > 0, "Ticket count must be greater than 0");
-        require(msg.value >= Raffles[raffleId].ticketPrice * _ticketCount, "Ticket price is greater than the amount sent");
-        Raffles[raffleId].ticketCount += _ticketCount;
-        if (Raffles[raffleId].ticketBalances[msg.sender] == 0) { // This will be a list of all of the unique ticket owners (in the order they buy them but that dosent matter dose it)
-            Raffles[raffleId].ticketOwners.push(msg.sender);
+        raffles[raffleId].ticketCount += SafeCast.toUint128(_ticketCount);
+        if (raffles[raffleId].ticketBalances[msg.sender] == 0) { // This will be a list of all of the unique ticket owners (in the order they buy them but that dosent matter dose it)
+            raffles[raffleId].ticketOwners.push(msg.sender);
         }
-        Raffles[raffleId].ticketBalances[msg.sender] += _ticketCount;
-        // If the buyer is not in the ticket owners array, add him
-        change += msg.value - Raffles[raffleId].ticketPrice * _ticketCount;
+        raffles[raffleId].ticketBalances[msg.sender] += _ticketCount;
+        raffles[raffleId].ticketRanges.push(TicketRange(msg.sender, SafeCast.toUint96(raffles[raffleId].ticketCount)));
+        emit TicketsPurchased(raffleId, msg.sender, _ticketCount);
+        return uint256(raffles[raffleId].ticketPrice) * _ticketCount;
     }
 
     // A function for the owner of the contract to collect all the change in the contract
@@ -158,17 +344,45 @@ contract CharityRaffle is Ownable, VRFConsumerBase {
         return _change;
     }
 
-    // A function for ticket buys to be refunded all the tickets they own
+    // A function for ticket buys to be refunded all the tickets they own, the refund is collected with Withdraw
     function TicketRefund(uint256 raffleId) public{
-        require(block.timestamp >= Raffles[raffleId].endTime + expirationPeriod, "The refund period has not ended yet");
-        require(Raffles[raffleId].state != RaffleState.Finished, "The raffle is finished");
-        require(Raffles[raffleId].state != RaffleState.SelectingWinner, "The raffle is selecting a winner.");
-        // Update the expiration of the raffle
-        Raffles[raffleId].state = RaffleState.Expired;
-        // Send the money back to the buyer
-        (bool transfered, ) = payable(msg.sender).call{value: Raffles[raffleId].ticketPrice * Raffles[raffleId].ticketBalances[msg.sender]}("");
-        if (transfered) {
-            Raffles[raffleId].ticketBalances[msg.sender] = 0;
-        }
-    }
-}
\ No newline at end of file
+        _creditRefund(raffleId);
+    }
+
+    // A function to be refunded the tickets of many expired raffles in a single transaction
+    function TicketRefundBatch(uint256[] calldata raffleIds) public{
+        for (uint256 i = 0; i < raffleIds.length; i++) {
+            _creditRefund(raffleIds[i]);
+        }
+    }
+
+    function _creditRefund(uint256 raffleId) internal {
+        require(raffleId > 0 && raffleId <= RaffleCount.current(), "The raffle does not exist");
+        require(block.timestamp >= raffles[raffleId].endTime + expirationPeriod, "The refund period has not ended yet");
+        require(raffles[raffleId].state != RaffleState.Finished, "The raffle is finished");
+        require(raffles[raffleId].state != RaffleState.SelectingWinner, "The raffle is selecting a winner.");
+        // Update the expiration of the raffle, only the first refund has to write it
+        if (raffles[raffleId].state != RaffleState.Expired) {
+            raffles[raffleId].state = RaffleState.Expired;
+        }
+        uint256 refundedTickets = raffles[raffleId].ticketBalances[msg.sender];
+        if (refundedTickets == 0) {
+            return;
+        }
+        raffles[raffleId].ticketBalances[msg.sender] = 0;
+        uint256 amount = uint256(raffles[raffleId].ticketPrice) * refundedTickets;
+        pendingWithdrawals[msg.sender] += amount;
+        emit TicketsRefunded(raffleId, msg.sender, refundedTickets, amount);
+    }
+
+    // A function to collect all of the refunds and payouts credited to the sender, across every raffle
+    function Withdraw() public returns (uint256){
+        uint256 amount = pendingWithdrawals[msg.sender];
+        require(amount > 0, "There is nothing to withdraw");
+        pendingWithdrawals[msg.sender] = 0;
+        (bool sent, ) = payable(msg.sender).call{value: amount}("");
+        require(sent, "The withdrawal could not be sent");
+        emit Withdrawal(msg.sender, amount);
+        return amount;
+    }
+}
@@ -0,0 +1,156 @@
+from scripts.helpers import smart_get_account, get_contract, fund_link, LOCAL_BLOCKCHAIN_ENVIRONMENTS
+from brownie import network, accounts, config, chain, web3, CharityRaffle
+from random import Random
+import json
+import math
+import os
+import pytest
+
+# Fuzzing of the winner selection, run with `brownie test fuzz`
+# Every case buys a random mix of tickets (a whale, lots of single tickets, repeat buyers, ...) and claims the raffle,
+# then replays many draws of the VRF callback against a snapshot of the claimed raffle
+# Every winner is checked against a plain walk over the purchases, and the winner counts of each buyer
+# are checked against their share of the tickets with a chi-square test
+# Set RAFFLE_FUZZ_CASES and RAFFLE_FUZZ_DRAWS to run more cases and draws per case, RAFFLE_FUZZ_SEED to change the inputs
+# The winner counts are written to reports/fuzz_histogram.json
+
+ticketPrice = 0.001*10**18
+length = 60
+exp_time = 120
+
+CASES = int(os.environ.get("RAFFLE_FUZZ_CASES", 5))
+DRAWS = int(os.environ.get("RAFFLE_FUZZ_DRAWS", 1000))
+SEED = int(os.environ.get("RAFFLE_FUZZ_SEED", 1234))
+MAX_BUYERS = 20
+MAX_PURCHASES = 60
+MAX_TICKETS_PER_PURCHASE = 50 # What the whale buys each time
+
+REPORT_DIR = "reports"
+
+@pytest.fixture(scope="module", autouse=True)
+def local_only():
+    if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        pytest.skip("The fuzzing replays the mock VRF callback on a local network")
+
+# Collects the winner counts of every case that ran, the report is written once they are done
+@pytest.fixture(scope="session")
+def histograms():
+    results = {}
+    yield results
+    if not results:
+        return
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    with open(os.path.join(REPORT_DIR, "fuzz_histogram.json"), "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+@pytest.fixture(scope="module")
+def buyers():
+    extra = [accounts.add() for _ in range(MAX_BUYERS)]
+    for account in extra:
+        # A buyer can make every purchase of a case at the largest count, every case is reverted afterwards
+        smart_get_account(0).transfer(account, ticketPrice * MAX_TICKETS_PER_PURCHASE * MAX_PURCHASES + MAX_PURCHASES * 300000 * web3.eth.gas_price)
+    return extra
+
+@pytest.fixture(scope="module")
+def raffle():
+    return CharityRaffle.deploy(
+        exp_time,
+        get_contract("vrf_coordinator").address,
+        get_contract("link_token").address,
+        config["networks"][network.show_active()]["fee"],
+        config["networks"][network.show_active()]["keyhash"],
+        {'from': smart_get_account(0)},
+    )
+
+# A list of (buyer index, ticket count) purchases in the order they are made
+def random_purchases(rng):
+    shape = rng.choice(["even", "whale", "singles", "mixed"])
+    buyerCount = rng.randint(1, MAX_BUYERS)
+    purchaseCount = rng.randint(1, MAX_PURCHASES)
+    purchases = []
+    for i in range(purchaseCount):
+        buyer = rng.randrange(buyerCount)
+        if shape == "even":
+            count = 3
+        elif shape == "whale":
+            count = MAX_TICKETS_PER_PURCHASE if buyer == 0 else 1
+        elif shape == "singles":
+            count = 1
+        else:
+            count = rng.randint(1, 10)
+        purchases.append((buyer, count))
+    return shape, purchases
+
+# The reference rule written out the long way: count through the purchases until the winning ticket
+def reference_winner(purchases, randomness):
+    ticket = randomness % sum(count for buyer, count in purchases)
+    for buyer, count in purchases:
+        if ticket < count:
+            return buyer
+        ticket -= count
+
+# Upper critical value of the chi-square distribution at p = 0.001 (Wilson-Hilferty approximation)
+def chi_square_limit(degrees):
+    z = 3.09
+    return degrees * (1 - 2 / (9 * degrees) + z * math.sqrt(2 / (9 * degrees))) ** 3
+
+# Buyers expected to win less than 5 times are lumped together so the test stays valid
+def chi_square(wins, shares, draws):
+    observed, expected = [], []
+    smallObserved, smallExpected = 0, 0
+    for buyer, share in shares.items():
+        if share * draws < 5:
+            smallObserved += wins.get(buyer, 0)
+            smallExpected += share * draws
+        else:
+            observed.append(wins.get(buyer, 0))
+            expected.append(share * draws)
+    if smallExpected > 0:
+        observed.append(smallObserved)
+        expected.append(smallExpected)
+    statistic = sum((o - e) ** 2 / e for o, e in zip(observed, expected))
+    return statistic, len(observed) - 1
+
+@pytest.mark.parametrize("case", range(CASES))
+def test_winner_fuzz(raffle, buyers, histograms, case):
+    # Arrange
+    rng = Random(SEED * 1000 + case)
+    shape, purchases = random_purchases(rng)
+    owner = smart_get_account(0)
+    chain.snapshot()
+    createTx = raffle.CreateRaffle("Fuzz Raffle", ticketPrice, length, {'from': owner})
+    raffleId = createTx.events['RaffleCreated']['raffleId']
+    for buyer, count in purchases:
+        raffle.BuyTickets(raffleId, count, {'from': buyers[buyer], 'value': ticketPrice*count})
+    chain.sleep(length)
+    chain.mine()
+    fund_link(raffle.address, account=owner)
+    claimTx = raffle.ClaimRaffle(raffleId, {'from': owner})
+    requestId = claimTx.events['RequestRandomness']['requestId']
+    coordinator = get_contract("vrf_coordinator")
+    totalTickets = sum(count for buyer, count in purchases)
+    # The edges of the ticket range and of uint256 first, then random 256 bit values like the VRF gives
+    edges = [0, totalTickets - 1, totalTickets, 2**256 - 1]
+    draws = edges + [rng.getrandbits(256) for _ in range(DRAWS)]
+    # Act
+    wins = {}
+    for i, randomness in enumerate(draws):
+        # brownie only keeps one snapshot, so every draw is undone with a nested one straight from the node
+        drawSnapshot = web3.provider.make_request("evm_snapshot", [])["result"]
+        coordinator.callBackWithRandomness(requestId, randomness, raffle.address, {'from': owner})
+        Dname, Dbeneficiary, Dwinner, DstartTime, DendTime = raffle.GetRaffleInfo(raffleId)
+        web3.provider.make_request("evm_revert", [drawSnapshot])
+        # Assert
+        expected = reference_winner(purchases, randomness)
+        assert Dwinner == buyers[expected].address, "randomness {} in case {} ({})".format(randomness, case, shape)
+        if i >= len(edges): # Only the random draws go in the histogram
+            wins[expected] = wins.get(expected, 0) + 1
+    chain.revert()
+    balances = {}
+    for buyer, count in purchases:
+        balances[buyer] = balances.get(buyer, 0) + count
+    shares = {buyer: count / totalTickets for buyer, count in balances.items()}
+    histograms["case {} ({})".format(case, shape)] = {"tickets": {str(b): c for b, c in balances.items()}, "wins": {str(b): w for b, w in wins.items()}}
+    if len(shares) > 1:
+        statistic, degrees = chi_square(wins, shares, DRAWS)
+        assert degrees == 0 or statistic < chi_square_limit(degrees), "winner counts {} for ticket balances {}".format(wins, balances)
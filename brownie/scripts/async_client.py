@@ -0,0 +1,91 @@
+from scripts.helpers import RaffleRecord, process_log
+from brownie import web3
+from eth_utils import event_abi_to_log_topic
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import asyncio
+
+# An asyncio client for CharityRaffle so one process can drive many raffles at once
+# The blocking brownie calls run on a thread pool, transactions from the same account are sent one at a time
+# to keep their nonces in order, and wait_for_winner watches for the WinnerChosen event instead of sleeping
+# Use it with `async with AsyncRaffleClient(raffle) as client:` (or call close) so its thread pool is shut down
+
+class AsyncRaffleClient:
+    def __init__(self, raffle, workers=16, poll_interval=1):
+        self.raffle = raffle
+        self.poll_interval = poll_interval
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.contract = web3.eth.contract(address=raffle.address, abi=raffle.abi)
+        self.winnerTopic = "0x" + event_abi_to_log_topic(next(abi for abi in raffle.abi if abi["type"] == "event" and abi["name"] == "WinnerChosen")).hex()
+        self._accountLocks = {}
+
+    async def _run(self, fn, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(fn, *args, **kwargs))
+
+    async def _transact(self, account, method, *args, value=0):
+        def send():
+            tx = method(*args, {'from': account, 'value': value})
+            tx.wait(1)
+            return tx
+        lock = self._accountLocks.setdefault(str(account), asyncio.Lock())
+        async with lock:
+            return await self._run(send)
+
+    async def create_raffle(self, account, name, ticketPrice, length):
+        tx = await self._transact(account, self.raffle.CreateRaffle, name, ticketPrice, length)
+        return tx.events["RaffleCreated"]["raffleId"]
+
+    async def buy_tickets(self, account, raffleId, ticketCount, price=None):
+        if price is None:
+            price = (await self.info(raffleId)).ticketPrice * ticketCount
+        return await self._transact(account, self.raffle.BuyTickets, raffleId, ticketCount, value=price)
+
+    async def claim_raffle(self, account, raffleId):
+        tx = await self._transact(account, self.raffle.ClaimRaffle, raffleId)
+        return tx.events["RequestRandomness"]["requestId"]
+
+    async def refund(self, account, raffleIds):
+        return await self._transact(account, self.raffle.TicketRefundBatch, raffleIds)
+
+    async def withdraw(self, account):
+        tx = await self._transact(account, self.raffle.Withdraw)
+        return tx.events["Withdrawal"]["amount"]
+
+    async def info(self, raffleId):
+        page = await self._run(self.raffle.GetRafflesPage, raffleId - 1, 1) if raffleId > 0 else []
+        if not page:
+            raise ValueError("Raffle {} does not exist".format(raffleId))
+        return RaffleRecord(*page[0])
+
+    # Resolves to (winner, ticketIndex) once the raffle has a winner
+    # Without fromBlock the logs are only scanned from now on, and a winner that was already picked comes back with a None ticket index
+    async def wait_for_winner(self, raffleId, fromBlock=None, timeout=None):
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        if fromBlock is None:
+            # Read the block before the state, so a winner picked in between is still in the logs we scan
+            fromBlock = await self._run(lambda: web3.eth.block_number)
+            info = await self.info(raffleId)
+            if info.state == 2: # Finished
+                return info.winner, None
+        while True:
+            latest = await self._run(lambda: web3.eth.block_number)
+            if latest >= fromBlock:
+                logs = await self._run(web3.eth.get_logs, {"address": self.raffle.address, "fromBlock": fromBlock, "toBlock": latest, "topics": [self.winnerTopic]})
+                for log in logs:
+                    args = process_log(self.contract.events.WinnerChosen(), log)["args"]
+                    if args["raffleId"] == raffleId:
+                        return args["winner"], args["ticketIndex"]
+                fromBlock = latest + 1
+            if deadline is not None and loop.time() >= deadline:
+                raise asyncio.TimeoutError("No winner chosen for raffle {}".format(raffleId))
+            await asyncio.sleep(self.poll_interval)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
@@ -0,0 +1,67 @@
+from scripts.helpers import read_deployment_manifest, write_deployment_manifest, LOCAL_BLOCKCHAIN_ENVIRONMENTS
+from scripts.deploy_worker import deploy_worker, verify_worker
+from brownie import config
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+import os
+
+# Deploys CharityRaffle to many networks at once, ex: `brownie run scripts/deploy_all.py main rinkeby,kovan 2`
+# or only to local ganache instances for testing, ex: `brownie run scripts/deploy_all.py local 3`
+# Every target is deployed from its own worker process, local targets are fresh ganache instances on their own ports
+# The source verification is left out of the deploys and queued on a separate pool once a deploy is done,
+# so a slow explorer doesn't hold the other networks up
+# Every result is written to the deployment manifest (see helpers.DEPLOYMENT_MANIFEST), which get_raffle reads on live networks
+# Keystore accounts can't ask for their password from a worker, set ACCOUNT_PASSWORD for live targets
+
+BASE_PORT = 8601
+
+# Every network of brownie-config.yaml that isn't a local one
+def config_targets():
+    return [name for name in config["networks"] if name != "default" and name not in LOCAL_BLOCKCHAIN_ENVIRONMENTS]
+
+def manifest_key(target, port):
+    return target if port is None else "{}@{}".format(target, port)
+
+def deploy_all(targets = None, localInstances = 0, basePort = BASE_PORT, workers = None):
+    targets = config_targets() if targets is None else targets
+    jobs = [(target, None) for target in targets] + [("development", basePort + i) for i in range(localInstances)]
+    if not jobs:
+        print("Nothing to deploy")
+        return {}
+    projectPath = os.path.abspath(".")
+    manifest = read_deployment_manifest()
+    context = multiprocessing.get_context("spawn") # A forked worker would share this process' network connection
+    with ProcessPoolExecutor(max_workers=workers or len(jobs), mp_context=context) as deployPool, \
+            ProcessPoolExecutor(max_workers=max(1, len(targets)), mp_context=context) as verifyPool:
+        deploys = {deployPool.submit(deploy_worker, target, port, projectPath): manifest_key(target, port) for target, port in jobs}
+        verifications = {}
+        for future in as_completed(deploys):
+            key = deploys[future]
+            try:
+                entry = future.result()
+            except Exception as e:
+                print("Deploy to", key, "failed:", e)
+                continue
+            print("Deployed to", key, "at", entry["CharityRaffle"], "in", entry["deployTime"], "s")
+            manifest[key] = entry
+            write_deployment_manifest(manifest)
+            if entry["verify"]:
+                verifications[verifyPool.submit(verify_worker, entry["network"], entry["CharityRaffle"], projectPath)] = key
+        for future in as_completed(verifications):
+            key = verifications[future]
+            try:
+                manifest[key]["verified"] = future.result()
+            except Exception as e:
+                print("Verification on", key, "failed:", e)
+                manifest[key]["verified"] = False
+            write_deployment_manifest(manifest)
+    return manifest
+
+# brownie run passes the arguments as strings: a comma separated list of networks ("" for every network in the config)
+# and the number of local ganache instances
+def main(targets = "", localInstances = 0):
+    targets = [target for target in targets.split(",") if target] if isinstance(targets, str) else targets
+    deploy_all(targets or None, int(localInstances))
+
+def local(instances = 2):
+    deploy_all([], int(instances))
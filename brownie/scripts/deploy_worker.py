@@ -0,0 +1,55 @@
+from brownie import network, project, config, chain
+from brownie._config import CONFIG
+import os
+import sys
+import time
+
+# The work done in the worker processes of scripts/deploy_all.py
+# Workers start from a fresh interpreter (spawn) and import this module to run a job, so it can only import from brownie at the top:
+# the other scripts import the contract containers, which only exist once the worker has loaded the project
+
+def _connect(target, port, projectPath):
+    os.chdir(projectPath)
+    if projectPath not in sys.path:
+        sys.path.insert(0, projectPath)
+    if not project.get_loaded_projects():
+        project.load(projectPath)
+    if port is not None:
+        CONFIG.networks[target]["cmd_settings"]["port"] = port
+    network.connect(target)
+
+def deploy_worker(target, port, projectPath):
+    _connect(target, port, projectPath)
+    from scripts.helpers import get_account, get_contract, clear_contract_cache
+    from scripts.runCharityRaffle import deploy_raffle_contract
+    try:
+        clear_contract_cache() # A reused worker may still hold the mocks of the last local instance
+        start = time.time()
+        raffle = deploy_raffle_contract(publish_source=False, account=get_account())
+        entry = {
+            "network": target,
+            "chainid": chain.id,
+            "CharityRaffle": raffle.address,
+            "vrf_coordinator": get_contract("vrf_coordinator").address,
+            "link_token": get_contract("link_token").address,
+            "block": raffle.tx.block_number if raffle.tx else None,
+            "deployer": str(raffle.owner()),
+            "deployTime": round(time.time() - start, 2),
+            "local": port is not None,
+            "verify": bool(config["networks"][target].get("verify", False)),
+            "verified": None,
+        }
+        if port is not None: # Local instances go away with the worker, so check they work while they're up
+            raffle.CreateRaffle("Smoke Test", 1, 60, {'from': get_account()})
+            entry["smokeTest"] = raffle.GetRaffleCount() == 1
+        return entry
+    finally:
+        network.disconnect()
+
+def verify_worker(target, address, projectPath):
+    _connect(target, None, projectPath)
+    from brownie import CharityRaffle
+    try:
+        return bool(CharityRaffle.publish_source(CharityRaffle.at(address)))
+    finally:
+        network.disconnect()
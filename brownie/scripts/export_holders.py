@@ -0,0 +1,88 @@
+from scripts.runCharityRaffle import get_raffle
+import csv
+import json
+import os
+
+# Streams the ticket holders or the ticket ranges of a raffle to a CSV or JSONL file, ex:
+#   brownie run scripts/export_holders.py main 1 holders.csv
+#   brownie run scripts/export_holders.py main 1 ranges.jsonl ranges
+# The rows are read a page at a time and written as they come, so memory use doesn't grow with the raffle
+# holders: one row per ticket owner (in the order they first bought) with their ticket balance
+# ranges: one row per purchase with the tickets it holds, firstTicket to lastTicket, a draw of ticket index i is won by the range holding i
+# An export can be picked up where it stopped with resume (the rows already in the file are skipped) or from a given offset
+
+HOLDER_FIELDS = ["index", "owner", "balance"]
+RANGE_FIELDS = ["index", "owner", "firstTicket", "lastTicket", "tickets"]
+
+def iter_holders(raffle, raffleId, offset = 0, pageSize = 500):
+    while True:
+        owners, balances = raffle.GetRaffleHoldersPage(raffleId, offset, pageSize)
+        for i, (owner, balance) in enumerate(zip(owners, balances)):
+            yield {"index": offset + i, "owner": str(owner), "balance": int(balance)}
+        if len(owners) < pageSize:
+            return
+        offset += pageSize
+
+def iter_ticket_ranges(raffle, raffleId, offset = 0, pageSize = 500):
+    # A range starts where the one before it ends, an offset past the last range has nothing left to read
+    start = 0
+    if offset > 0:
+        owners, ends = raffle.GetTicketRangesPage(raffleId, offset - 1, 1)
+        if not ends:
+            return
+        start = int(ends[0])
+    while True:
+        owners, ends = raffle.GetTicketRangesPage(raffleId, offset, pageSize)
+        for i, (owner, end) in enumerate(zip(owners, ends)):
+            yield {"index": offset + i, "owner": str(owner), "firstTicket": start, "lastTicket": int(end) - 1, "tickets": int(end) - start}
+            start = int(end)
+        if len(owners) < pageSize:
+            return
+        offset += pageSize
+
+# Number of rows already in an export, read a line at a time
+def count_rows(path, fmt):
+    if not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        lines = sum(1 for line in f if line.strip())
+    return max(0, lines - 1) if fmt == "csv" else lines # Without the CSV header
+
+def write_rows(rows, fields, path, fmt, append):
+    written = 0
+    with open(path, "a" if append else "w", newline="") as f:
+        if fmt == "csv":
+            writer = csv.DictWriter(f, fieldnames=fields)
+            if not append:
+                writer.writeheader()
+            for row in rows:
+                writer.writerow(row)
+                written += 1
+        else:
+            for row in rows:
+                f.write(json.dumps(row) + "\n")
+                written += 1
+    return written
+
+# Returns the number of rows written, the format comes from the file extension unless given
+def export(raffleId, path, kind = "holders", offset = 0, resume = False, pageSize = 500, fmt = None, raffle = None):
+    raffle = raffle if raffle else get_raffle()
+    fmt = fmt if fmt else ("jsonl" if path.endswith(".jsonl") else "csv")
+    if kind not in ("holders", "ranges"):
+        raise ValueError("kind must be holders or ranges")
+    if resume:
+        offset = count_rows(path, fmt)
+    append = offset > 0 and os.path.exists(path)
+    if kind == "holders":
+        rows, fields = iter_holders(raffle, raffleId, offset, pageSize), HOLDER_FIELDS
+    else:
+        rows, fields = iter_ticket_ranges(raffle, raffleId, offset, pageSize), RANGE_FIELDS
+    return write_rows(rows, fields, path, fmt, append)
+
+def main(raffleId, path = "holders.csv", kind = "holders", offset = 0):
+    written = export(int(raffleId), path, kind, offset=int(offset))
+    print("Exported", written, kind, "of raffle", raffleId, "to", path)
+
+def resume(raffleId, path = "holders.csv", kind = "holders"):
+    written = export(int(raffleId), path, kind, resume=True)
+    print("Exported", written, "more", kind, "of raffle", raffleId, "to", path)
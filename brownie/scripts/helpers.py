@@ -1,34 +1,114 @@
 from brownie import network, accounts, config, Contract, VRFCoordinatorMock, LinkToken, interface
 from brownie.network import contract
+from collections import namedtuple
+import json
+import os
+import tempfile
 
 LOCAL_BLOCKCHAIN_ENVIRONMENTS = ["development","ganache-local"]
 FORKED = ["mainnet-fork","mainnet-fork-dev"]
 
+# One entry of CharityRaffle.GetRafflesPage
+RaffleRecord = namedtuple("RaffleRecord", ["id", "name", "beneficiary", "winner", "startTime", "endTime", "ticketCount", "ticketPrice", "state", "paidOut", "nameHash"])
+
 def get_account(index = 0, id = None): # Automaticaly gets a good account
     if id != None:
-        return accounts.load(id)
+        return load_account(id)
     if network.show_active() in LOCAL_BLOCKCHAIN_ENVIRONMENTS or network.show_active() in FORKED:
         return accounts[index]
-    return accounts.load("test1")
+    return load_account("test1")
+
+# Keystore accounts are decrypted the first time they're used and kept for the rest of the run
+# They ask for their password unless ACCOUNT_PASSWORD is set (needed for unattended runs like scripts/deploy_all.py)
+_loaded_accounts = {}
+
+def load_account(id):
+    if id not in _loaded_accounts:
+        _loaded_accounts[id] = accounts.load(id, password=os.getenv("ACCOUNT_PASSWORD"))
+    return _loaded_accounts[id]
 
 def smart_get_account(index):
     if network.show_active() in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
         return accounts[index]
-    return accounts.load("test"+str(index+1))
+    return load_account("test"+str(index+1))
 
 contract_to_mock = {
  "vrf_coordinator": VRFCoordinatorMock,
  "link_token": LinkToken
 }
 
+# Contract handles that have already been resolved, keyed by (network, contract name)
+# Switching networks gives new keys, and redeploying a contract replaces its entry
+# The handles are given out wrapped by the profiler when RAFFLE_PROFILE is set (see scripts/profiler.py)
+# The profiler is imported where it's used, so loading the helpers doesn't load it
+_contract_cache = {}
+
+def get_cached_contract(contract_name, resolve):
+    from scripts.profiler import wrap
+    key = (network.show_active(), contract_name)
+    if key not in _contract_cache:
+        _contract_cache[key] = wrap(resolve())
+    return _contract_cache[key]
+
+def cache_contract(contract_name, contract):
+    from scripts.profiler import wrap
+    _contract_cache[(network.show_active(), contract_name)] = wrap(contract)
+    return _contract_cache[(network.show_active(), contract_name)]
+
+def clear_contract_cache(contract_name = None):
+    if contract_name is None:
+        _contract_cache.clear()
+        return
+    for key in [key for key in _contract_cache if key[1] == contract_name]:
+        del _contract_cache[key]
+
+# Where scripts/deploy_all.py records what it deployed, keyed by network (local instances as network@port)
+# Each entry holds the CharityRaffle, vrf_coordinator and link_token addresses, the chain id, the block and the verification status
+DEPLOYMENT_MANIFEST = "deployment-manifest.json"
+_manifest = None
+
+def read_deployment_manifest(path = DEPLOYMENT_MANIFEST):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def write_deployment_manifest(manifest, path = DEPLOYMENT_MANIFEST):
+    global _manifest
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    with os.fdopen(fd, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, path) # Readers never see a half written manifest
+    _manifest = None
+
+# The manifest entry of a network, the file is read once per run
+def get_deployment(network_name):
+    global _manifest
+    if _manifest is None:
+        _manifest = read_deployment_manifest()
+    return _manifest.get(network_name)
+
+# Decodes a log with a web3 contract event, web3 v6 renamed processLog to process_log
+def process_log(event, log):
+    return (getattr(event, "process_log", None) or event.processLog)(log)
+
 def deploy_mocks():
+    from scripts.profiler import section
     account = get_account()
-    link_token = LinkToken.deploy({"from": account})
-    VRFCoordinatorMock.deploy(link_token.address, {"from": account})
+    with section("LinkToken.deploy"):
+        link_token = LinkToken.deploy({"from": account})
+    with section("VRFCoordinatorMock.deploy"):
+        vrf_coordinator = VRFCoordinatorMock.deploy(link_token.address, {"from": account})
+    cache_contract("link_token", link_token)
+    cache_contract("vrf_coordinator", vrf_coordinator)
     print("Mocks deployed")
 
 # A function that gets a contract from the brownie config and deploy mocks if needed
 def get_contract(contract_name):
+    return get_cached_contract(contract_name, lambda: _resolve_contract(contract_name))
+
+def _resolve_contract(contract_name):
     contract_type = contract_to_mock[contract_name]
     if network.show_active() in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
         if len(contract_type) <= 0:
@@ -47,7 +127,8 @@ def fund_link(contract_address, account = None, link = None, amount = 0.1*10**18
     if network.show_active() in LOCAL_BLOCKCHAIN_ENVIRONMENTS: link.fund({'from': account}) # Gime link
     print("link:", link, "balance", link.balanceOf(account))
     # tx = link.transfer(contract_address, amount, {"from": account}) # Cringe way using a transaction
-    link_contract = interface.LinkTokenInterface(link.address)
+    from scripts.profiler import wrap
+    link_contract = wrap(interface.LinkTokenInterface(link.address))
     tx = link_contract.transfer(contract_address, amount, {"from": account}) # Using the interface
     tx.wait(1)
     print("Funded link")
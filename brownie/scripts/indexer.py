@@ -0,0 +1,170 @@
+from scripts.helpers import get_deployment, process_log, LOCAL_BLOCKCHAIN_ENVIRONMENTS
+from scripts.runCharityRaffle import get_raffle
+from brownie import network, config, web3
+from eth_utils import event_abi_to_log_topic
+import sqlite3
+
+# Builds a local SQLite copy of the raffles, ticket holders and winners from the contract's event logs
+# The logs are read in block ranges and the last indexed block is stored, so a sync picks up where the last one stopped
+# It is also the name cache for raffles made with CreateRaffleWithMetadata, whose names are only in the RaffleMetadata event
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (address TEXT PRIMARY KEY, block INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS raffles (
+    id INTEGER PRIMARY KEY,
+    beneficiary TEXT NOT NULL,
+    winner TEXT,
+    winning_ticket INTEGER,
+    ticket_count INTEGER NOT NULL DEFAULT 0,
+    created_block INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tickets (
+    raffle_id INTEGER NOT NULL,
+    holder TEXT NOT NULL,
+    tickets INTEGER NOT NULL DEFAULT 0,
+    refunded INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (raffle_id, holder)
+);
+CREATE TABLE IF NOT EXISTS names (raffle_id INTEGER PRIMARY KEY, name_hash TEXT NOT NULL, name TEXT NOT NULL);
+"""
+
+# The block to start indexing from: the deployment transaction, the deployment manifest or the network's start_block in
+# brownie-config.yaml, local chains can start at 0 but a live chain is never scanned from its first block
+def deployment_block(raffle):
+    tx = getattr(raffle, "tx", None)
+    if tx:
+        return tx.block_number
+    deployment = get_deployment(network.show_active())
+    if deployment and deployment["CharityRaffle"] == raffle.address and deployment.get("block") is not None:
+        return deployment["block"]
+    startBlock = config["networks"].get(network.show_active(), {}).get("start_block")
+    if startBlock is not None:
+        return startBlock
+    if network.show_active() in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        return 0
+    raise ValueError("The deployment block of {} is unknown, set start_block for {} in brownie-config.yaml or pass start_block".format(raffle.address, network.show_active()))
+
+class RaffleIndexer:
+    def __init__(self, raffle, db_path="raffle_index.db", chunk_size=2000, start_block=None):
+        self.raffle = raffle
+        self.address = raffle.address
+        self.chunk_size = chunk_size
+        self.db = sqlite3.connect(db_path)
+        self.db.executescript(SCHEMA)
+        self.start_block = deployment_block(raffle) if start_block is None else start_block
+        self.contract = web3.eth.contract(address=self.address, abi=raffle.abi)
+        self.handlers = {
+            "RaffleCreated": self._on_raffle_created,
+            "RaffleMetadata": self._on_raffle_metadata,
+            "TicketsPurchased": self._on_tickets_purchased,
+            "TicketsRefunded": self._on_tickets_refunded,
+            "WinnerChosen": self._on_winner_chosen,
+        }
+        self.topics = {
+            event_abi_to_log_topic(abi): abi["name"]
+            for abi in raffle.abi if abi["type"] == "event" and abi["name"] in self.handlers
+        }
+
+    def checkpoint(self):
+        row = self.db.execute("SELECT block FROM checkpoints WHERE address = ?", (self.address,)).fetchone()
+        return row[0] if row else self.start_block - 1
+
+    def sync(self, to_block=None):
+        to_block = web3.eth.block_number if to_block is None else to_block
+        from_block = self.checkpoint() + 1
+        while from_block <= to_block:
+            end_block = min(from_block + self.chunk_size - 1, to_block)
+            logs = web3.eth.get_logs({"address": self.address, "fromBlock": from_block, "toBlock": end_block})
+            with self.db: # Each chunk and its checkpoint are committed together
+                for log in sorted(logs, key=lambda log: (log["blockNumber"], log["logIndex"])):
+                    name = self.topics.get(bytes(log["topics"][0]))
+                    if name is None:
+                        continue
+                    event = process_log(self.contract.events[name](), log)
+                    self.handlers[name](event["args"], log["blockNumber"])
+                self.db.execute(
+                    "INSERT INTO checkpoints (address, block) VALUES (?, ?) ON CONFLICT(address) DO UPDATE SET block = excluded.block",
+                    (self.address, end_block),
+                )
+            from_block = end_block + 1
+        return to_block
+
+    def _on_raffle_created(self, args, block):
+        self.db.execute(
+            "INSERT OR IGNORE INTO raffles (id, beneficiary, created_block) VALUES (?, ?, ?)",
+            (args["raffleId"], args["beneficiary"], block),
+        )
+
+    def _on_raffle_metadata(self, args, block):
+        self.db.execute(
+            "INSERT OR REPLACE INTO names (raffle_id, name_hash, name) VALUES (?, ?, ?)",
+            (args["raffleId"], "0x" + bytes(args["nameHash"]).hex(), args["name"]),
+        )
+
+    def _on_tickets_purchased(self, args, block):
+        self.db.execute(
+            "UPDATE raffles SET ticket_count = ticket_count + ? WHERE id = ?",
+            (args["ticketCount"], args["raffleId"]),
+        )
+        self.db.execute(
+            "INSERT INTO tickets (raffle_id, holder, tickets) VALUES (?, ?, ?) "
+            "ON CONFLICT(raffle_id, holder) DO UPDATE SET tickets = tickets + excluded.tickets",
+            (args["raffleId"], args["buyer"], args["ticketCount"]),
+        )
+
+    def _on_tickets_refunded(self, args, block):
+        self.db.execute(
+            "UPDATE tickets SET tickets = 0, refunded = refunded + ? WHERE raffle_id = ? AND holder = ?",
+            (args["ticketCount"], args["raffleId"], args["buyer"]),
+        )
+
+    def _on_winner_chosen(self, args, block):
+        self.db.execute(
+            "UPDATE raffles SET winner = ?, winning_ticket = ? WHERE id = ?",
+            (args["winner"], args["ticketIndex"], args["raffleId"]),
+        )
+
+    # Local queries over the indexed data
+    def holders(self, raffle_id):
+        return self.db.execute(
+            "SELECT holder, tickets FROM tickets WHERE raffle_id = ? AND tickets > 0 ORDER BY rowid",
+            (raffle_id,),
+        ).fetchall()
+
+    def winners(self):
+        return self.db.execute("SELECT id, winner, winning_ticket FROM raffles WHERE winner IS NOT NULL ORDER BY id").fetchall()
+
+    def raffles(self):
+        return self.db.execute("SELECT id, beneficiary, winner, ticket_count FROM raffles ORDER BY id").fetchall()
+
+    def name(self, raffle_id):
+        row = self.db.execute("SELECT name FROM names WHERE raffle_id = ?", (raffle_id,)).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        self.db.close()
+
+# The name of a raffle, from the local cache for hashed names (syncing it once if the raffle isn't in it yet)
+# and from the contract for raffles that store their name
+def resolve_raffle_name(raffle_id, indexer=None):
+    if indexer is None: # A database opened here is closed here
+        indexer = RaffleIndexer(get_raffle())
+        try:
+            return resolve_raffle_name(raffle_id, indexer)
+        finally:
+            indexer.close()
+    name = indexer.name(raffle_id)
+    if name is None and bytes(indexer.raffle.GetRaffleNameHash(raffle_id)) != bytes(32):
+        indexer.sync()
+        name = indexer.name(raffle_id)
+    if name is None:
+        name = indexer.raffle.GetRaffleInfo(raffle_id)[0]
+    return name
+
+def main():
+    indexer = RaffleIndexer(get_raffle())
+    block = indexer.sync()
+    print("Indexed up to block", block)
+    for id, beneficiary, winner, ticketCount in indexer.raffles():
+        print("RaffleId", id, "Name", resolve_raffle_name(id, indexer), "Beneficiary", beneficiary, "Winner", winner, "TicketCount", ticketCount, "Holders", len(indexer.holders(id)))
+    indexer.close()
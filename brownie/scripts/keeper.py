@@ -0,0 +1,141 @@
+from scripts.helpers import get_account, get_contract, fund_link, RaffleRecord, LOCAL_BLOCKCHAIN_ENVIRONMENTS
+from scripts.runCharityRaffle import get_raffle
+from scripts.tx_pipeline import TxPipeline
+from brownie import network, chain
+import heapq
+import time
+
+# A long running keeper that claims the raffles of its beneficiary accounts as soon as they end
+# Open raffles are kept in a queue ordered by endTime, the keeper sleeps until the next one ends,
+# tops up the contract's LINK only when it would not cover the claims, and sends the claims in batches
+# Raffles getting close to endTime + expirationPeriod are reported so none of them expire by accident
+# A claim that fails (a revert or an RPC error) goes back in the queue and is retried with a growing delay until the raffle expires
+
+RAFFLE_OPEN = 0
+
+class RaffleKeeper:
+    def __init__(self, raffle, beneficiaries, link=None, funder=None, batchSize=10, pageSize=100, expiryMargin=3600, refreshInterval=60, retryDelay=15, maxRetryDelay=600):
+        self.raffle = raffle
+        self.beneficiaries = {str(account): account for account in beneficiaries}
+        self.link = link if link else get_contract("link_token")
+        self.funder = funder if funder else beneficiaries[0]
+        self.batchSize = batchSize
+        self.pageSize = pageSize
+        self.expiryMargin = expiryMargin
+        self.refreshInterval = refreshInterval
+        self.retryDelay = retryDelay
+        self.maxRetryDelay = maxRetryDelay
+        self.expirationPeriod = raffle.expirationPeriod()
+        self.linkFee = raffle.linkFee()
+        self.queue = [] # (time the raffle is due, raffleId), the endTime unless a claim failed
+        self.endTimes = {} # raffleId => endTime of the queued raffles
+        self.attempts = {} # raffleId => failed claims
+        self.seen = 0 # Raffles already read, new ones are picked up from here
+
+    def now(self):
+        if network.show_active() in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+            return chain.time()
+        return int(time.time())
+
+    # Reads the raffles created since the last refresh and queues the open ones we can claim
+    def refresh(self):
+        count = self.raffle.GetRaffleCount()
+        while self.seen < count:
+            for record in [RaffleRecord(*raffle) for raffle in self.raffle.GetRafflesPage(self.seen, self.pageSize)]:
+                if record.state == RAFFLE_OPEN and record.beneficiary in self.beneficiaries:
+                    heapq.heappush(self.queue, (record.endTime, record.id))
+                    self.endTimes[record.id] = record.endTime
+            self.seen = min(count, self.seen + self.pageSize)
+        return len(self.queue)
+
+    # Open raffles that will expire within expiryMargin seconds
+    def expiring(self, now):
+        return [id for dueTime, id in self.queue if now >= self.endTimes[id] + self.expirationPeriod - self.expiryMargin]
+
+    def _due(self, now):
+        due = []
+        while self.queue and self.queue[0][0] <= now:
+            dueTime, id = heapq.heappop(self.queue)
+            if now >= self.endTimes[id] + self.expirationPeriod:
+                print("Raffle", id, "expired before it could be claimed")
+                self._forget(id)
+                continue
+            try:
+                record = RaffleRecord(*self.raffle.GetRafflesPage(id - 1, 1)[0])
+            except Exception as e:
+                print("Could not read raffle", id, e)
+                heapq.heappush(self.queue, (now + self.retryDelay, id))
+                continue
+            # Raffles claimed by hand or without tickets are skipped, an empty raffle has no winner to pick
+            if record.state == RAFFLE_OPEN and record.ticketCount > 0:
+                due.append(record)
+            else:
+                self._forget(id)
+        return due
+
+    def _forget(self, id):
+        self.endTimes.pop(id, None)
+        self.attempts.pop(id, None)
+
+    # Puts raffles whose claim failed back in the queue, the delay doubles with every failure
+    def _retry(self, records, now):
+        for record in records:
+            self.attempts[record.id] = self.attempts.get(record.id, 0) + 1
+            delay = min(self.retryDelay * 2 ** (self.attempts[record.id] - 1), self.maxRetryDelay)
+            print("Retrying the claim of raffle", record.id, "in", delay, "s")
+            heapq.heappush(self.queue, (now + delay, record.id))
+
+    # Sends LINK only when the contract's balance would not cover claimCount claims
+    def top_up_link(self, claimCount):
+        needed = self.linkFee * claimCount
+        balance = self.link.balanceOf(self.raffle.address)
+        if balance < needed:
+            fund_link(self.raffle.address, account=self.funder, link=self.link, amount=needed - balance)
+
+    # Claims every raffle that has ended, returns the ids that were claimed
+    def run_once(self, now=None):
+        now = self.now() if now is None else now
+        for id in self.expiring(now):
+            print("Raffle", id, "is close to expiring")
+        due = self._due(now)
+        claimed = []
+        for start in range(0, len(due), self.batchSize):
+            batch = due[start:start+self.batchSize]
+            try:
+                self.top_up_link(len(batch))
+            except Exception as e:
+                print("Could not top up the LINK", e)
+                self._retry(batch, now)
+                continue
+            with TxPipeline() as pipeline:
+                futures = [(record, pipeline.submit(self.beneficiaries[record.beneficiary], self.raffle.ClaimRaffle, record.id)) for record in batch]
+                for record, future in futures:
+                    try:
+                        if future.result().receipt["status"] == 1:
+                            claimed.append(record.id)
+                            self._forget(record.id)
+                            continue
+                        print("Claim of raffle", record.id, "reverted")
+                    except Exception as e:
+                        print("Could not claim raffle", record.id, e)
+                    self._retry([record], now)
+        return claimed
+
+    # Seconds until the next raffle ends, capped so new raffles are still picked up
+    def next_wake(self, now):
+        if not self.queue:
+            return self.refreshInterval
+        return max(0, min(self.queue[0][0] - now, self.refreshInterval))
+
+    def run_forever(self):
+        while True:
+            self.refresh()
+            claimed = self.run_once()
+            if claimed:
+                print("Claimed raffles", claimed)
+            time.sleep(self.next_wake(self.now()))
+
+def main():
+    account = get_account(index=0) if network.show_active() in LOCAL_BLOCKCHAIN_ENVIRONMENTS else get_account(id="test1")
+    keeper = RaffleKeeper(get_raffle(), [account])
+    keeper.run_forever()
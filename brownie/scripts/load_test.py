@@ -0,0 +1,208 @@
+from scripts.helpers import get_account, get_contract, fund_link, LOCAL_BLOCKCHAIN_ENVIRONMENTS
+from scripts.runCharityRaffle import deploy_raffle_contract
+from scripts.tx_pipeline import TxPipeline
+from brownie import network, accounts, config, chain, web3
+from brownie.network.account import LocalAccount
+from concurrent.futures import wait as wait_futures
+from random import Random
+import json
+import math
+import os
+import threading
+import time
+
+# A load generator for a local chain, ex: `brownie run scripts/load_test.py main 1000 8 50 60`
+# (1000 donors, 8 raffles, 50 purchases a second on average for 60 seconds)
+# Fresh donor accounts are funded, then the purchases arrive as a Poisson process (with an optional surge in the middle
+# of the run, ex: a campaign going live) on raffles picked by popularity, with mostly small and a few large ticket counts
+# Once the raffles end, half of them are claimed and drawn through the VRFCoordinatorMock and the other half expire,
+# so every donor in them is refunded, and everyone credited withdraws
+# Every transaction goes through TxPipeline, the report has the throughput, latency percentiles and gas of each operation
+# (and how far the sender fell behind the arrival schedule) and is written to reports/load_test.json
+
+REPORT_PATH = os.path.join("reports", "load_test.json")
+ticketPrice = 0.001*10**18
+CALLBACK_GAS = 500000 # The estimate can come in under what the mock forwards to the callback
+
+# Purchase times over the run, rate is per second, surge multiplies the rate at the middle of the run (thinning of a Poisson process)
+def arrival_times(rng, rate, duration, surge = 0):
+    peak = rate * (1 + surge)
+    t = 0
+    while True:
+        t += rng.expovariate(peak)
+        if t >= duration:
+            return
+        if rng.random() * peak <= rate * (1 + surge * math.exp(-((t - duration / 2) / (duration / 8)) ** 2)):
+            yield t
+
+# Most donors buy a ticket or two and a few buy a lot
+def ticket_count(rng, maxTickets):
+    return min(maxTickets, int(rng.paretovariate(1.2)))
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+# Times every transaction from when it's queued to when its receipt is in
+class LoadRecorder:
+    def __init__(self):
+        self.entries = []
+        self._lock = threading.Lock()
+
+    def track(self, operation, future):
+        entry = {"operation": operation, "submitted": time.perf_counter(), "done": None, "gas": None, "error": None}
+        with self._lock:
+            self.entries.append(entry)
+        future.add_done_callback(lambda f: self._done(entry, f))
+        return future
+
+    def _done(self, entry, future):
+        entry["done"] = time.perf_counter()
+        try:
+            receipt = future.result().receipt
+            entry["gas"] = receipt["gasUsed"]
+            if receipt["status"] != 1:
+                entry["error"] = "reverted"
+        except Exception as e:
+            entry["error"] = str(e)[:200]
+
+    def summarize(self):
+        summary = {}
+        for operation in sorted(set(entry["operation"] for entry in self.entries)):
+            entries = [entry for entry in self.entries if entry["operation"] == operation]
+            ok = [entry for entry in entries if entry["error"] is None]
+            latencies = sorted(entry["done"] - entry["submitted"] for entry in ok)
+            gas = [entry["gas"] for entry in ok]
+            wall = max(entry["done"] for entry in entries) - min(entry["submitted"] for entry in entries)
+            row = {"count": len(entries), "errors": len(entries) - len(ok), "throughput": round(len(ok) / wall, 2) if wall > 0 else None}
+            if ok:
+                row.update({"p50": round(percentile(latencies, 0.5), 4), "p90": round(percentile(latencies, 0.9), 4),
+                            "p99": round(percentile(latencies, 0.99), 4), "max": round(latencies[-1], 4),
+                            "avg_gas": sum(gas) // len(gas), "max_gas": max(gas)})
+            row["sample_errors"] = sorted(set(entry["error"] for entry in entries if entry["error"] is not None))[:5]
+            summary[operation] = row
+        return summary
+
+# Queues the transactions of a phase and waits for all of them, returns the (args, future) of each
+def run_phase(recorder, operation, jobs, submit, senders):
+    with TxPipeline(senders=senders, confirmers=senders) as pipeline:
+        futures = [(job, recorder.track(operation, submit(pipeline, job))) for job in jobs]
+        wait_futures([future for job, future in futures])
+    return futures
+
+def succeeded(future):
+    return future.exception() is None and future.result().receipt["status"] == 1
+
+def request_ids(receipt):
+    topic = web3.keccak(text="RequestRandomness(bytes32)")
+    return [log["data"] for log in receipt["logs"] if log["topics"] and bytes(log["topics"][0]) == bytes(topic)]
+
+def run_load(donors = 200, raffles = 4, rate = 20, duration = 30, surge = 0, seed = 1234, maxTickets = 20, senders = 32, raffle = None, reportPath = REPORT_PATH):
+    if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        raise ValueError("The load test drives the VRFCoordinatorMock and jumps the chain's time, run it on a local network")
+    rng = Random(seed)
+    owner = get_account(index=0)
+    raffle = raffle if raffle else deploy_raffle_contract(account=owner)
+    localAccounts = [account for account in accounts if not isinstance(account, LocalAccount)] # The node's funded accounts
+    beneficiaries = [localAccounts[1 + i % (len(localAccounts) - 1)] for i in range(raffles)]
+    recorder = LoadRecorder()
+    phases = {}
+    length = int(duration * 2) + 60 # The purchases run on the chain's clock too
+    startedAt = time.perf_counter()
+
+    # Funding: enough for the purchases each donor is expected to make at the peak rate, plus gas
+    donorAccounts = [accounts.add() for _ in range(donors)]
+    purchasesPerDonor = math.ceil(rate * (1 + surge) * duration / donors) + 1
+    funding = int((purchasesPerDonor + 2) * (ticketPrice * maxTickets + 300000 * web3.eth.gas_price))
+    start = time.perf_counter()
+    run_phase(recorder, "fund", list(enumerate(donorAccounts)), lambda pipeline, job: pipeline.submit_tx(
+        localAccounts[job[0] % len(localAccounts)], {"to": job[1].address, "value": funding, "gas": 21000}), senders)
+    phases["fund"] = round(time.perf_counter() - start, 3)
+
+    # CreateRaffle, from several beneficiaries at once
+    firstId = raffle.GetRaffleCount() + 1
+    start = time.perf_counter()
+    run_phase(recorder, "CreateRaffle", beneficiaries, lambda pipeline, beneficiary: pipeline.submit(
+        beneficiary, raffle.CreateRaffle, "Load test raffle", ticketPrice, length), senders)
+    phases["CreateRaffle"] = round(time.perf_counter() - start, 3)
+    ids = list(range(firstId, raffle.GetRaffleCount() + 1))
+    accountOf = {account.address: account for account in beneficiaries}
+    beneficiaryOf = {int(summary[0]): accountOf[summary[2]] for summary in raffle.GetRafflesPage(firstId - 1, len(ids))}
+
+    # BuyTickets: Poisson arrivals, the first raffles are the most popular ones
+    weights = [1 / (i + 1) for i in range(len(ids))]
+    purchases = []
+    schedulerLag = 0
+    start = time.perf_counter()
+    with TxPipeline(senders=senders, confirmers=senders) as pipeline:
+        for at in arrival_times(rng, rate, duration, surge):
+            delay = start + at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            schedulerLag = max(schedulerLag, -delay)
+            donor, raffleId, count = rng.choice(donorAccounts), rng.choices(ids, weights)[0], ticket_count(rng, maxTickets)
+            future = pipeline.submit(donor, raffle.BuyTickets, raffleId, count, value=ticketPrice * count)
+            purchases.append(((donor, raffleId), recorder.track("BuyTickets", future)))
+        wait_futures([future for job, future in purchases])
+    phases["BuyTickets"] = round(time.perf_counter() - start, 3)
+    holders = sorted(set(job for job, future in purchases if succeeded(future)), key=lambda job: (job[1], job[0].address))
+    chain.sleep(length)
+    chain.mine()
+
+    # ClaimRaffle on every other raffle that sold tickets, then the VRF draws
+    soldIds = sorted(set(raffleId for donor, raffleId in holders))
+    claimedIds = soldIds[::2]
+    if claimedIds:
+        fund_link(raffle.address, account=owner, amount=config["networks"][network.show_active()]["fee"] * len(claimedIds))
+    start = time.perf_counter()
+    claims = run_phase(recorder, "ClaimRaffle", claimedIds, lambda pipeline, raffleId: pipeline.submit(
+        beneficiaryOf[raffleId], raffle.ClaimRaffle, raffleId), senders)
+    phases["ClaimRaffle"] = round(time.perf_counter() - start, 3)
+    requests = [requestId for raffleId, future in claims if succeeded(future) for requestId in request_ids(future.result().receipt)]
+    vrfCoordinator = get_contract("vrf_coordinator")
+    start = time.perf_counter()
+    run_phase(recorder, "fulfillRandomness", requests, lambda pipeline, requestId: pipeline.submit(
+        owner, vrfCoordinator.callBackWithRandomness, requestId, rng.getrandbits(256), raffle.address, gas=CALLBACK_GAS), senders)
+    phases["fulfillRandomness"] = round(time.perf_counter() - start, 3)
+
+    # The other raffles expire and their donors are refunded
+    chain.sleep(raffle.expirationPeriod())
+    chain.mine()
+    refunds = [job for job in holders if job[1] not in claimedIds]
+    start = time.perf_counter()
+    refunded = run_phase(recorder, "TicketRefund", refunds, lambda pipeline, job: pipeline.submit(job[0], raffle.TicketRefund, job[1]), senders)
+    phases["TicketRefund"] = round(time.perf_counter() - start, 3)
+
+    # Withdraw: refunded donors and the beneficiaries that were paid out
+    withdrawers = sorted(set(job[0] for job, future in refunded if succeeded(future)), key=lambda account: account.address)
+    withdrawers += sorted(set(beneficiaryOf[raffleId] for raffleId in claimedIds), key=lambda account: account.address)
+    start = time.perf_counter()
+    run_phase(recorder, "Withdraw", withdrawers, lambda pipeline, account: pipeline.submit(account, raffle.Withdraw), senders)
+    phases["Withdraw"] = round(time.perf_counter() - start, 3)
+
+    report = {
+        "config": {"donors": donors, "raffles": raffles, "rate": rate, "duration": duration, "surge": surge, "seed": seed, "maxTickets": maxTickets, "senders": senders},
+        "total": round(time.perf_counter() - startedAt, 3),
+        "phases": phases,
+        "schedulerLag": round(schedulerLag, 4),
+        "operations": recorder.summarize(),
+    }
+    os.makedirs(os.path.dirname(reportPath) or ".", exist_ok=True)
+    with open(reportPath, "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+def print_report(report):
+    print("{:<18} {:>7} {:>7} {:>9} {:>8} {:>8} {:>8} {:>8} {:>9} {:>9}".format("operation", "count", "errors", "tx/s", "p50 s", "p90 s", "p99 s", "max s", "avg gas", "max gas"))
+    for operation, row in report["operations"].items():
+        print("{:<18} {:>7} {:>7} {:>9} {:>8} {:>8} {:>8} {:>8} {:>9} {:>9}".format(operation, row["count"], row["errors"], row["throughput"],
+            row.get("p50", "-"), row.get("p90", "-"), row.get("p99", "-"), row.get("max", "-"), row.get("avg_gas", "-"), row.get("max_gas", "-")))
+        for error in row["sample_errors"]:
+            print("    ", error)
+    # A growing lag means the sender can't keep up with the arrival rate, the tooling is the bottleneck rather than the chain
+    print("Phases:", report["phases"], "total", report["total"], "s, the sender fell behind the arrivals by up to", report["schedulerLag"], "s")
+
+# brownie run passes the arguments as strings
+def main(donors = 200, raffles = 4, rate = 20, duration = 30, surge = 0, seed = 1234):
+    report = run_load(int(donors), int(raffles), float(rate), float(duration), float(surge), int(seed))
+    print_report(report)
+    print("Load test report written to", REPORT_PATH)
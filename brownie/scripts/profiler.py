@@ -0,0 +1,184 @@
+from brownie import web3
+from brownie.network.contract import ContractCall, ContractTx, OverloadedMethod
+from contextlib import contextmanager
+import atexit
+import json
+import os
+import threading
+import time
+
+# Opt-in profiling of the operational scripts, turned on with RAFFLE_PROFILE=1
+# The contract handles given out by helpers.get_contract and runCharityRaffle.get_raffle are wrapped, so every call records
+# its latency, the time spent in RPC round trips, how long the transaction waited to be confirmed and the gas it used
+# Deploys and sleeps in the scripts are recorded as sections, and the time before the scripts were loaded
+# (starting brownie, compiling and connecting to the network) as startup
+# At exit a summary per function is printed and the raw trace is written to reports/profile.json
+
+ENABLED = os.environ.get("RAFFLE_PROFILE", "") not in ("", "0")
+REPORT_PATH = os.path.join("reports", "profile.json")
+SEND_METHODS = ["eth_sendTransaction", "eth_sendRawTransaction"]
+
+trace = []
+_traceLock = threading.Lock()
+_local = threading.local() # The call being profiled on each thread
+_started = time.time()
+_installed = False
+
+def record(entry):
+    with _traceLock:
+        trace.append(entry)
+
+# Times the RPC requests made on the thread of the call being profiled
+# brownie waits for confirmations on a thread of its own, so that time shows up between the send and the end of the call
+def _rpc_middleware(make_request, w3):
+    def middleware(method, params):
+        call = getattr(_local, "call", None)
+        if call is None:
+            return make_request(method, params)
+        start = time.perf_counter()
+        try:
+            return make_request(method, params)
+        finally:
+            end = time.perf_counter()
+            call["rpc"] += end - start
+            call["rpcCalls"] += 1
+            if method in SEND_METHODS:
+                call["sentAt"] = end
+    return middleware
+
+def _install():
+    global _installed
+    if not _installed:
+        web3.middleware_onion.add(_rpc_middleware, name="raffle_profiler")
+        _installed = True
+
+# Takes the middleware back out of web3, the next ProfiledContract installs it again
+def uninstall():
+    global _installed
+    if _installed:
+        web3.middleware_onion.remove("raffle_profiler")
+        _installed = False
+
+@contextmanager
+def _profiled_call(function, kind):
+    call = {"rpc": 0, "rpcCalls": 0, "sentAt": None}
+    outer = getattr(_local, "call", None) # Calls made inside a section are recorded on their own
+    _local.call = call
+    start = time.perf_counter()
+    entry = {"function": function, "kind": kind, "start": round(time.time() - _started, 4), "gas": None, "error": None}
+    try:
+        yield entry
+    except Exception as e:
+        entry["error"] = type(e).__name__
+        raise
+    finally:
+        end = time.perf_counter()
+        _local.call = outer
+        entry["latency"] = round(end - start, 4)
+        entry["rpc"] = round(call["rpc"], 4)
+        entry["rpcCalls"] = call["rpcCalls"]
+        entry["wait"] = round(end - call["sentAt"], 4) if call["sentAt"] is not None else None
+        record(entry)
+
+class ProfiledMethod:
+    def __init__(self, function, method):
+        self._function = function
+        self._method = method
+
+    def _is_transaction(self, args):
+        if isinstance(self._method, OverloadedMethod):
+            return bool(args) and isinstance(args[-1], dict)
+        return isinstance(self._method, ContractTx)
+
+    def __call__(self, *args, **kwargs):
+        kind = "transaction" if self._is_transaction(args) else "call"
+        with _profiled_call(self._function, kind) as entry:
+            result = self._method(*args, **kwargs)
+            if kind == "transaction":
+                entry["gas"] = result.gas_used
+            return result
+
+    # encode_input, call, _address, ... are passed straight through (TxPipeline uses them)
+    def __getattr__(self, name):
+        return getattr(self._method, name)
+
+class ProfiledContract:
+    def __init__(self, contract):
+        _install()
+        self._contract = contract
+        self._name = getattr(contract, "_name", type(contract).__name__)
+
+    def __getattr__(self, name):
+        attr = getattr(self._contract, name)
+        if isinstance(attr, (ContractCall, ContractTx, OverloadedMethod)):
+            return ProfiledMethod(self._name + "." + name, attr)
+        return attr
+
+    def __str__(self):
+        return str(self._contract)
+
+    def __repr__(self):
+        return repr(self._contract)
+
+    def __eq__(self, other):
+        return self._contract == (other._contract if isinstance(other, ProfiledContract) else other)
+
+    def __hash__(self):
+        return hash(self._contract)
+
+# Wraps a contract handle when profiling is on, returns it as is otherwise
+def wrap(contract):
+    if not ENABLED or isinstance(contract, ProfiledContract):
+        return contract
+    return ProfiledContract(contract)
+
+# Records a block of script code that isn't a contract call, ex: `with section("sleep"): time.sleep(20)`
+@contextmanager
+def section(name):
+    if not ENABLED:
+        yield
+        return
+    with _profiled_call(name, "section"):
+        yield
+
+def summarize(entries):
+    summary = {}
+    for entry in entries:
+        row = summary.setdefault(entry["function"], {"kind": entry["kind"], "calls": 0, "errors": 0, "latency": 0, "rpc": 0, "wait": 0, "gas": 0, "max_latency": 0})
+        row["calls"] += 1
+        row["errors"] += entry["error"] is not None
+        row["latency"] += entry["latency"]
+        row["rpc"] += entry["rpc"]
+        row["wait"] += entry["wait"] or 0
+        row["gas"] += entry["gas"] or 0
+        row["max_latency"] = max(row["max_latency"], entry["latency"])
+    for row in summary.values():
+        row["avg_latency"] = round(row["latency"] / row["calls"], 4)
+        row["avg_gas"] = row["gas"] // row["calls"]
+        row["latency"] = round(row["latency"], 4)
+        row["rpc"] = round(row["rpc"], 4)
+        row["wait"] = round(row["wait"], 4)
+    return summary
+
+def print_summary(summary, startup, total):
+    print("{:<40} {:>11} {:>6} {:>10} {:>10} {:>10} {:>10} {:>10}".format("function", "kind", "calls", "total s", "rpc s", "wait s", "avg s", "avg gas"))
+    for function, row in sorted(summary.items(), key=lambda item: -item[1]["latency"]):
+        print("{:<40} {:>11} {:>6} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f} {:>10}".format(
+            function, row["kind"], row["calls"], row["latency"], row["rpc"], row["wait"], row["avg_latency"], row["avg_gas"] or "-"))
+    # Contract calls can run inside a section, so only the calls themselves count as contract call time
+    tracked = sum(row["latency"] for row in summary.values() if row["kind"] != "section")
+    print("Startup (brownie, compiling, connecting): {:.3f}s, run: {:.3f}s, in contract calls: {:.3f}s".format(startup, total, tracked))
+
+def write_report(path=REPORT_PATH):
+    import psutil # Only needed for the report, so the profiler can be imported without it
+    startup = round(_started - psutil.Process().create_time(), 4)
+    total = round(time.time() - _started, 4)
+    summary = summarize(trace)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"startup": startup, "total": total, "summary": summary, "trace": trace}, f, indent=2)
+    print_summary(summary, startup, total)
+    print("Profile written to", path)
+
+if ENABLED:
+    atexit.register(write_report)
@@ -1,44 +1,61 @@
-from scripts.helpers import get_account, get_contract, fund_link, LOCAL_BLOCKCHAIN_ENVIRONMENTS
-from brownie import network, accounts, config, CharityRaffle
+from scripts.helpers import get_account, get_contract, get_cached_contract, cache_contract, get_deployment, fund_link, RaffleRecord, LOCAL_BLOCKCHAIN_ENVIRONMENTS
+from brownie import network, accounts, config, Contract, CharityRaffle
+import asyncio
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 ticketPrice = 0.01*10**18
 exp_time = 604800
 
-def deploy_raffle_contract():
-    account = get_account(id="test1")
+# publish_source defaults to the network's verify setting, scripts/deploy_all.py turns it off and verifies afterwards
+def deploy_raffle_contract(publish_source = None, account = None):
+    from scripts.profiler import section
+    account = account if account else get_account(id="test1")
     print("account:", account)
-    raffle = CharityRaffle.deploy(
-        exp_time,
-        get_contract("vrf_coordinator").address,
-        get_contract("link_token").address,
-        config["networks"][network.show_active()]["fee"],
-        config["networks"][network.show_active()]["keyhash"],
-        {'from': account},
-        publish_source = config["networks"][network.show_active()].get("verify", False)
-        )
+    vrfCoordinator, linkToken = get_contract("vrf_coordinator").address, get_contract("link_token").address
+    with section("CharityRaffle.deploy"): # Includes the source verification when it's turned on
+        raffle = CharityRaffle.deploy(
+            exp_time,
+            vrfCoordinator,
+            linkToken,
+            config["networks"][network.show_active()]["fee"],
+            config["networks"][network.show_active()]["keyhash"],
+            {'from': account},
+            publish_source = config["networks"][network.show_active()].get("verify", False) if publish_source is None else publish_source
+            )
     print("Charity raffle@", raffle)
-    return raffle
+    return cache_contract("charity_raffle", raffle)
 
 def get_raffle():
-    try: 
-        if CharityRaffle[-1]: return CharityRaffle[-1]
-        else: return deploy_raffle_contract()
-    except: 
-        return deploy_raffle_contract()
+    return get_cached_contract("charity_raffle", _resolve_raffle)
+
+# Live networks use the address from the deployment manifest when there is one, instead of going through CharityRaffle's deployments
+def _resolve_raffle():
+    deployment = get_deployment(network.show_active())
+    if deployment and network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        return Contract.from_abi("CharityRaffle", deployment["CharityRaffle"], CharityRaffle.abi)
+    if len(CharityRaffle) > 0:
+        return CharityRaffle[-1]
+    return deploy_raffle_contract()
 
-def create_raffle(name, ticketPrice, lenght):
+# With hashName only the hash of the name is stored, read the name back with scripts.indexer.resolve_raffle_name
+def create_raffle(name, ticketPrice, lenght, hashName = False):
     account = get_account(id="test1")
     raffle = get_raffle()
-    createTx = raffle.CreateRaffle(name, ticketPrice, lenght, {'from': account})
+    create = raffle.CreateRaffleWithMetadata if hashName else raffle.CreateRaffle
+    createTx = create(name, ticketPrice, lenght, {'from': account})
     createTx.wait(1)
     print("Created raffle")
 
 
+def list_raffles(offset, limit):
+    return [RaffleRecord(*raffle) for raffle in get_raffle().GetRafflesPage(offset, limit)]
+
 def get_raffle_info(id):
-    raffle = get_raffle()
-    name, beneficiary, winner, startTime, endTime = raffle.GetRaffleInfo(id)
-    name, startTime, endTime, ticketCount, ticketPrice = raffle.GetRaffleTicketInfo(id)
+    page = list_raffles(id-1, 1) if id > 0 else []
+    if not page:
+        raise ValueError("Raffle {} does not exist".format(id))
+    _, name, beneficiary, winner, startTime, endTime, ticketCount, ticketPrice, _, _, _ = page[0]
     print("RaffleId", id, "RaffleName", name, "Beneficiary", beneficiary, "Winner", winner, "StartTime", startTime, "EndTime", endTime, "TicketCount", ticketCount, "TicketPrice", ticketPrice)
 
 def enter_raffle(id, account, ticketCount = 1, price = 0):
@@ -48,6 +65,36 @@ def enter_raffle(id, account, ticketCount = 1, price = 0):
     enterTx.wait(1)
     print("Entered raffle")
 
+# Enters many accounts at once, entries is a list of (account, ticketCount)
+def enter_raffle_parallel(id, entries):
+    from scripts.profiler import section
+    from scripts.tx_pipeline import TxPipeline
+    raffle = get_raffle()
+    with section("enter_raffle_parallel"), TxPipeline() as pipeline: # The pipeline sends from its own threads, so it's timed as a whole
+        for account, ticketCount in entries:
+            pipeline.submit(account, raffle.BuyTickets, id, ticketCount, value=ticketPrice * ticketCount)
+        results = pipeline.wait()
+    entered = [result for result in results if result.receipt["status"] == 1]
+    print("Entered raffle", len(entered), "times,", len(results) - len(entered), "purchases reverted")
+    return results
+
+# Without a price the value is worked out from each raffle's own ticket price, read with one GetRafflesPage call
+def enter_raffles(ids, account, ticketCounts, price = 0):
+    raffle = get_raffle()
+    price = batch_price(ids, ticketCounts) if price == 0 else price
+    enterTx = raffle.BuyTicketsBatch(ids, ticketCounts, {'from': account, 'value': price})
+    enterTx.wait(1)
+    print("Entered raffles", ids)
+
+def batch_price(ids, ticketCounts):
+    first = max(min(ids), 1)
+    records = list_raffles(first - 1, max(ids) - first + 1) if max(ids) >= first else []
+    prices = {record.id: record.ticketPrice for record in records}
+    missing = [id for id in ids if id not in prices]
+    if missing:
+        raise ValueError("Raffles {} do not exist".format(missing))
+    return sum(prices[id] * ticketCount for id, ticketCount in zip(ids, ticketCounts))
+
 def collect_change():
     raffle = get_raffle()
     account = get_account(id="test1")
@@ -59,7 +106,9 @@ def get_change():
     raffle = get_raffle()
     print("Change amount", raffle.change())
 
-def claim_raffle(id, account=get_account(id="test1")):
+# The account is loaded when the raffle is claimed, not when this module is imported
+def claim_raffle(id, account = None):
+    account = account if account else get_account(id="test1")
     raffle = get_raffle()
     claimTx = raffle.ClaimRaffle(id, {'from': account})
     claimTx.wait(1)
@@ -73,10 +122,60 @@ def fake_VRF_response(requestId, value):
     callTx.wait(1)
     print("Fake VRF response done", callTx.events)
 
+# Credits the refunds of expired raffles to the account, they are then collected with withdraw
+def refund_tickets(ids, account):
+    raffle = get_raffle()
+    if len(ids) == 1:
+        refundTx = raffle.TicketRefund(ids[0], {'from': account})
+    else:
+        refundTx = raffle.TicketRefundBatch(ids, {'from': account})
+    refundTx.wait(1)
+    print("Refunded raffles", ids)
+
+def withdraw(account):
+    raffle = get_raffle()
+    withdrawTx = raffle.Withdraw({'from': account})
+    withdrawTx.wait(1)
+    amount = withdrawTx.events["Withdrawal"]["amount"]
+    print("Withdrew", amount)
+    return amount
+
+def get_pending_withdrawal(account):
+    return get_raffle().pendingWithdrawals(account)
+
 def get_balance(id, account):
     return get_raffle().GetRaffleBalance(id, account)
 
+# Reads the balances of many holders in chunks of chunkSize per call, with up to workers calls in flight
+def get_balances(id, holders, chunkSize = 500, workers = 4):
+    raffle = get_raffle()
+    holders = [str(holder) for holder in holders]
+    chunks = [holders[i:i+chunkSize] for i in range(0, len(holders), chunkSize)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(lambda chunk: raffle.GetRaffleBalances(id, chunk), chunks)
+        balances = {}
+        for chunk, chunkBalances in zip(chunks, results):
+            balances.update(zip(chunk, chunkBalances))
+    return balances
+
+# Reads every ticket holder of a raffle and their balance, pageSize holders per call
+def get_all_balances(id, pageSize = 500, workers = 4):
+    raffle = get_raffle()
+    offsets = range(0, raffle.GetRaffleHolderCount(id), pageSize)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pages = pool.map(lambda offset: raffle.GetRaffleHoldersPage(id, offset, pageSize), offsets)
+        balances = {}
+        for owners, pageBalances in pages:
+            balances.update(zip(owners, pageBalances))
+    return balances
+
+async def wait_for_winner(id, timeout = None):
+    from scripts.async_client import AsyncRaffleClient
+    async with AsyncRaffleClient(get_raffle()) as client:
+        return await client.wait_for_winner(id, timeout=timeout)
+
 def main():
+    from scripts.profiler import section
     raffle_time = 20
     
     get_raffle()
@@ -93,14 +192,11 @@ def main():
     else:
         print("Local")
         get_raffle_info(id)
-        enter_raffle(id, ticketCount=1, account=get_account(index=0))
-        get_raffle_info(id)
-        enter_raffle(id, ticketCount=3, account=get_account(index=1))
-        get_raffle_info(id)
-        enter_raffle(id, ticketCount=7, account=get_account(index=2))
+        enter_raffle_parallel(id, [(get_account(index=0), 1), (get_account(index=1), 3), (get_account(index=2), 7)])
     get_raffle_info(id)
     print("Test1",get_balance(id, get_account(index=2).address))
-    time.sleep(raffle_time) # Wait for the raffle to end
+    with section("sleep"):
+        time.sleep(raffle_time) # Wait for the raffle to end
     print("Waited")
     fund_link(get_raffle().address)
     requestId = claim_raffle(id)
@@ -108,8 +204,7 @@ def main():
     if network.show_active() in LOCAL_BLOCKCHAIN_ENVIRONMENTS:  
         print("Fake VRF response")
         fake_VRF_response(requestId, 3)
-        time.sleep(1)
-    else:
-        time.sleep(200)
-    print("Waited for VRF")
+    with section("wait_for_winner"):
+        winner, ticketIndex = asyncio.run(wait_for_winner(id, timeout=600))
+    print("Waited for VRF, winner", winner)
     get_raffle_info(id)
\ No newline at end of file
@@ -0,0 +1,161 @@
+from array import array
+from enum import IntEnum
+import numpy as np
+
+# A pure Python model of the CharityRaffle contract for what-if runs without a node
+# It follows the same rules and revert messages as the contract, with the block time passed in as `now`
+# Ticket ranges are kept in compact arrays (one entry per purchase) like the contract's ticketRanges,
+# so many draws can be resolved at once with a vectorised search
+
+class RaffleState(IntEnum):
+    Open = 0
+    SelectingWinner = 1
+    Finished = 2
+    Expired = 3
+
+class SimulationError(Exception):
+    pass
+
+def require(condition, message):
+    if not condition:
+        raise SimulationError(message)
+
+class SimRaffle:
+    def __init__(self, id, name, ticketPrice, beneficiary, startTime, endTime):
+        self.id = id
+        self.name = name
+        self.ticketCount = 0
+        self.ticketPrice = ticketPrice
+        self.beneficiary = beneficiary
+        self.winner = None
+        self.startTime = startTime
+        self.endTime = endTime
+        self.state = RaffleState.Open
+        self.paidOut = False
+        self.ticketBalances = {}
+        self.ticketOwners = []
+        self.rangeOwners = array("L") # index into the simulator's address table
+        self.rangeEnds = array("Q") # cumulative ticket count after each purchase
+
+class CharityRaffleSimulator:
+    def __init__(self, expirationPeriod, owner=None):
+        self.expirationPeriod = expirationPeriod
+        self.owner = owner
+        self.raffles = {}
+        self.change = 0
+        self.pendingWithdrawals = {} # Refunds and payouts credited to each address, collected with withdraw
+        self.paid = {} # Total amount sent out to each address
+        self.addresses = [] # Address table so the ranges only store small integers
+        self._addressIds = {}
+
+    def _address_id(self, address):
+        if address not in self._addressIds:
+            self._addressIds[address] = len(self.addresses)
+            self.addresses.append(address)
+        return self._addressIds[address]
+
+    def _pay(self, address, amount):
+        self.paid[address] = self.paid.get(address, 0) + amount
+
+    def _credit(self, address, amount):
+        self.pendingWithdrawals[address] = self.pendingWithdrawals.get(address, 0) + amount
+
+    def create_raffle(self, sender, name, ticketPrice, raffleLength, now):
+        id = len(self.raffles) + 1
+        self.raffles[id] = SimRaffle(id, name, ticketPrice, sender, now, now + raffleLength)
+        return id
+
+    # All the checks are done before anything is written, so a failed purchase leaves no trace like a revert
+    def _check_purchase(self, raffleId, ticketCount, now):
+        raffle = self.raffles.get(raffleId)
+        require(raffle is None or raffle.state == RaffleState.Open, "Raffle not open")
+        require(raffle is not None and now < raffle.endTime, "Raffle is closed")
+        require(ticketCount > 0, "Ticket count must be greater than 0")
+        return raffle.ticketPrice * ticketCount
+
+    def _buy_tickets(self, sender, raffleId, ticketCount):
+        raffle = self.raffles[raffleId]
+        raffle.ticketCount += ticketCount
+        if raffle.ticketBalances.get(sender, 0) == 0:
+            raffle.ticketOwners.append(sender)
+        raffle.ticketBalances[sender] = raffle.ticketBalances.get(sender, 0) + ticketCount
+        raffle.rangeOwners.append(self._address_id(sender))
+        raffle.rangeEnds.append(raffle.ticketCount)
+
+    def buy_tickets(self, sender, raffleId, ticketCount, value, now):
+        self.buy_tickets_batch(sender, [raffleId], [ticketCount], value, now)
+
+    def buy_tickets_batch(self, sender, raffleIds, ticketCounts, value, now):
+        require(len(raffleIds) == len(ticketCounts), "Raffle ids and ticket counts must be the same length")
+        cost = sum(self._check_purchase(id, count, now) for id, count in zip(raffleIds, ticketCounts))
+        require(value >= cost, "Ticket price is greater than the amount sent")
+        for id, count in zip(raffleIds, ticketCounts):
+            self._buy_tickets(sender, id, count)
+        self.change += value - cost
+
+    def claim_raffle(self, sender, raffleId, now):
+        raffle = self.raffles[raffleId]
+        require(sender == raffle.beneficiary, "Only the beneficiary can claim the raffle")
+        require(now >= raffle.endTime, "The raffle has not closed yet")
+        require(raffle.endTime + self.expirationPeriod > now, "The raffle has expired and cannot be claimed")
+        require(raffle.state == RaffleState.Open, "The raffle is not avaible for claiming")
+        raffle.state = RaffleState.SelectingWinner
+
+    def fulfill_randomness(self, raffleId, randomness):
+        raffle = self.raffles[raffleId]
+        require(raffle.state == RaffleState.SelectingWinner, "The raffle is not in the SelectingWinner state")
+        raffle.state = RaffleState.Finished
+        raffle.winner = self.winner_for(raffleId, randomness)
+        raffle.paidOut = True
+        self._credit(raffle.beneficiary, raffle.ticketPrice * raffle.ticketCount)
+        return raffle.winner
+
+    def ticket_refund(self, sender, raffleId, now):
+        return self.ticket_refund_batch(sender, [raffleId], now)
+
+    def ticket_refund_batch(self, sender, raffleIds, now):
+        for raffleId in raffleIds:
+            raffle = self.raffles.get(raffleId)
+            require(raffle is not None, "The raffle does not exist")
+            require(now >= raffle.endTime + self.expirationPeriod, "The refund period has not ended yet")
+            require(raffle.state != RaffleState.Finished, "The raffle is finished")
+            require(raffle.state != RaffleState.SelectingWinner, "The raffle is selecting a winner.")
+        total = 0
+        for raffleId in raffleIds:
+            raffle = self.raffles[raffleId]
+            raffle.state = RaffleState.Expired
+            refundedTickets = raffle.ticketBalances.get(sender, 0)
+            if refundedTickets == 0: # Nothing is credited, like the contract
+                continue
+            raffle.ticketBalances[sender] = 0
+            amount = raffle.ticketPrice * refundedTickets
+            self._credit(sender, amount)
+            total += amount
+        return total
+
+    def withdraw(self, sender):
+        amount = self.pendingWithdrawals.get(sender, 0)
+        require(amount > 0, "There is nothing to withdraw")
+        self.pendingWithdrawals[sender] = 0
+        self._pay(sender, amount)
+        return amount
+
+    def collect_change(self, sender):
+        require(self.owner is None or sender == self.owner, "Ownable: caller is not the owner")
+        require(self.change > 0, "There is no change to collect!")
+        change, self.change = self.change, 0
+        self._pay(sender, change)
+        return change
+
+    # The winner rule of the contract: ticket randomness % ticketCount, owned by the first range ending after it
+    def winner_for(self, raffleId, randomness):
+        return self.winners_for(raffleId, [randomness])[0]
+
+    # Resolves many draws at once, the modulo is done on Python ints since the randomness is 256 bits
+    def winners_for(self, raffleId, randomness):
+        raffle = self.raffles[raffleId]
+        ends = np.frombuffer(raffle.rangeEnds, dtype=np.uint64)
+        owners = np.frombuffer(raffle.rangeOwners, dtype=np.uint32 if raffle.rangeOwners.itemsize == 4 else np.uint64)
+        indices = np.fromiter((value % raffle.ticketCount for value in randomness), dtype=np.uint64, count=len(randomness))
+        ranges = np.searchsorted(ends, indices, side="right")
+        return [self.addresses[owner] for owner in owners[ranges]]
@@ -0,0 +1,160 @@
+import argparse
+import json
+import os
+import sys
+import urllib.request
+
+# A quick read-only look at a deployed CharityRaffle without starting brownie, ex:
+#   python scripts/status.py --network rinkeby raffles
+#   python scripts/status.py --network rinkeby raffle 1
+#   python scripts/status.py --rpc http://127.0.0.1:8545 --address 0x... balance 1 0x...
+# It talks JSON-RPC straight to the node with eth_abi doing the encoding, so it doesn't load brownie or web3:
+# there is no compiling, no project loading and no account unlocking
+# The ABI comes from the compiled build/contracts/CharityRaffle.json, so run `brownie compile` after changing the contract
+# The address comes from --address, the deployment manifest written by scripts/deploy_all.py or brownie's build/deployments/map.json
+# The RPC url comes from --rpc or from the network's host in brownie's network-config.yaml
+
+BUILD_PATH = os.path.join("build", "contracts", "CharityRaffle.json")
+DEPLOYMENT_MAP = os.path.join("build", "deployments", "map.json")
+DEPLOYMENT_MANIFEST = "deployment-manifest.json" # Same file as helpers.DEPLOYMENT_MANIFEST
+NETWORK_CONFIG = os.path.join(os.path.expanduser("~"), ".brownie", "network-config.yaml")
+STATES = ["Open", "SelectingWinner", "Finished", "Expired"]
+
+class StatusError(Exception):
+    pass
+
+def load_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def load_abi():
+    build = load_json(BUILD_PATH)
+    if build is None:
+        raise StatusError("No compiled contract at {}, run `brownie compile` once first".format(BUILD_PATH))
+    return build["abi"]
+
+# The network's entry of brownie's network-config.yaml, with the environment variables in the host filled in
+def network_settings(networkName):
+    if not os.path.exists(NETWORK_CONFIG):
+        return {}
+    if os.path.exists(".env"): # brownie loads it through the dotenv setting of brownie-config.yaml
+        from dotenv import load_dotenv
+        load_dotenv(".env")
+    import yaml
+    with open(NETWORK_CONFIG) as f:
+        networkConfig = yaml.safe_load(f)
+    entries = list(networkConfig.get("development", []))
+    for group in networkConfig.get("live", []):
+        entries += group.get("networks", [])
+    for entry in entries:
+        if entry["id"] == networkName:
+            host = os.path.expandvars(entry["host"])
+            if "cmd_settings" in entry and ":" not in host.split("//", 1)[-1]:
+                host += ":{}".format(entry["cmd_settings"].get("port", 8545))
+            return dict(entry, host=host)
+    return {}
+
+def resolve_address(networkName, chainId):
+    deployment = (load_json(DEPLOYMENT_MANIFEST) or {}).get(networkName)
+    if deployment:
+        return deployment["CharityRaffle"]
+    deployments = (load_json(DEPLOYMENT_MAP) or {}).get(str(chainId), {}).get("CharityRaffle")
+    if deployments:
+        return deployments[0] # brownie keeps the latest deployment first
+    raise StatusError("No CharityRaffle address known for {}, pass --address".format(networkName))
+
+# The type string eth_abi expects for an ABI input or output, tuples are spelled out from their components
+def abi_type(param):
+    if param["type"].startswith("tuple"):
+        return "(" + ",".join(abi_type(component) for component in param["components"]) + ")" + param["type"][len("tuple"):]
+    return param["type"]
+
+# Read-only calls to the contract
+class RaffleReader:
+    def __init__(self, rpc, address, abi):
+        self.rpc = rpc
+        self.address = address
+        self.functions = {item["name"]: item for item in abi if item.get("type") == "function"}
+
+    def _request(self, method, params):
+        body = json.dumps({"jsonrpc": "2.0", "id": 1, "method": method, "params": params}).encode()
+        request = urllib.request.Request(self.rpc, data=body, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=30) as response:
+            reply = json.load(response)
+        if "error" in reply:
+            raise StatusError("{} failed: {}".format(method, reply["error"].get("message", reply["error"])))
+        return reply["result"]
+
+    def call(self, name, *args):
+        import eth_abi
+        from eth_utils import function_abi_to_4byte_selector
+        encode = getattr(eth_abi, "encode", None) or eth_abi.encode_abi # eth_abi 4 renamed encode_abi and decode_abi
+        decode = getattr(eth_abi, "decode", None) or eth_abi.decode_abi
+        function = self.functions[name]
+        data = function_abi_to_4byte_selector(function) + encode([abi_type(param) for param in function["inputs"]], list(args))
+        result = self._request("eth_call", [{"to": self.address, "data": "0x" + data.hex()}, "latest"])
+        values = decode([abi_type(param) for param in function["outputs"]], bytes.fromhex(result[2:]))
+        return values[0] if len(values) == 1 else values
+
+def connect(args):
+    settings = network_settings(args.network)
+    rpc = args.rpc or settings.get("host")
+    if not rpc:
+        raise StatusError("Unknown network {}, pass --rpc".format(args.network))
+    address = args.address or resolve_address(args.network, settings.get("chainid"))
+    return RaffleReader(rpc, address, load_abi())
+
+def summary_fields(reader):
+    return [component["name"] for component in reader.functions["GetRafflesPage"]["outputs"][0]["components"]]
+
+def format_raffle(fields, raffle):
+    values = dict(zip(fields, raffle))
+    values["state"] = STATES[values["state"]]
+    if "nameHash" in values:
+        values["nameHash"] = "0x" + bytes(values["nameHash"]).hex()
+    return " ".join("{}={}".format(field, values[field]) for field in fields)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Read the state of a deployed CharityRaffle")
+    parser.add_argument("--network", default="development")
+    parser.add_argument("--rpc", help="RPC url, defaults to the network's host in brownie's network-config.yaml")
+    parser.add_argument("--address", help="CharityRaffle address, defaults to the deployed one")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("count", help="Number of raffles")
+    raffles = commands.add_parser("raffles", help="A page of raffles")
+    raffles.add_argument("offset", type=int, nargs="?", default=0)
+    raffles.add_argument("limit", type=int, nargs="?", default=20)
+    raffle = commands.add_parser("raffle", help="One raffle")
+    raffle.add_argument("id", type=int)
+    balance = commands.add_parser("balance", help="Tickets of an address in a raffle")
+    balance.add_argument("id", type=int)
+    balance.add_argument("owner")
+    pending = commands.add_parser("pending", help="Refunds and payouts an address can withdraw")
+    pending.add_argument("owner")
+    commands.add_parser("change", help="Change held by the contract")
+    args = parser.parse_args(argv)
+    try:
+        reader = connect(args)
+        if args.command == "count":
+            print(reader.call("GetRaffleCount"))
+        elif args.command in ("raffles", "raffle"):
+            offset, limit = (args.offset, args.limit) if args.command == "raffles" else (args.id - 1, 1)
+            fields = summary_fields(reader)
+            for raffle in reader.call("GetRafflesPage", offset, limit):
+                print(format_raffle(fields, raffle))
+        elif args.command == "balance":
+            print(reader.call("GetRaffleBalance", args.id, args.owner))
+        elif args.command == "pending":
+            print(reader.call("pendingWithdrawals", args.owner))
+        elif args.command == "change":
+            print(reader.call("change"))
+    except StatusError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+from scripts.helpers import get_account
+from scripts.runCharityRaffle import get_raffle
+from scripts.export_holders import iter_ticket_ranges
+from eth_utils import keccak
+from bisect import bisect_right
+import json
+import os
+
+# A Merkle snapshot of the ticket ranges of a closed raffle, so a draw can be checked without reading every purchase, ex:
+#   brownie run scripts/ticket_snapshot.py main 1           (writes reports/ticket_snapshot_1.json)
+#   brownie run scripts/ticket_snapshot.py publish 1        (stores the root with SetTicketRoot, owner only)
+#   brownie run scripts/ticket_snapshot.py prove 1 42       (proof that ticket 42 of raffle 1 belongs to its owner)
+# The leaves are the ticket ranges in purchase order (the ranges the winner is drawn from, see GetTicketRangesPage)
+# A leaf is keccak256(abi.encodePacked(owner, start, end)) and pairs are hashed sorted, like OpenZeppelin's MerkleProof
+# An auditor takes the ticketIndex of WinnerChosen, gets its proof and checks it with VerifyTicketProof (or verify_proof)
+
+REPORT_DIR = "reports"
+
+def leaf_hash(owner, start, end):
+    return keccak(bytes.fromhex(owner[2:]) + start.to_bytes(32, "big") + end.to_bytes(32, "big"))
+
+def hash_pair(a, b):
+    return keccak(a + b) if a <= b else keccak(b + a)
+
+class TicketTree:
+    # ranges are (owner, start, end) tuples in purchase order
+    def __init__(self, ranges):
+        if not ranges:
+            raise ValueError("The raffle has no tickets")
+        self.ranges = ranges
+        self.ends = [end for owner, start, end in ranges]
+        self.levels = [[leaf_hash(*ticketRange) for ticketRange in ranges]]
+        while len(self.levels[-1]) > 1:
+            level = self.levels[-1]
+            # A node without a sibling moves up as is
+            self.levels.append([hash_pair(level[i], level[i + 1]) if i + 1 < len(level) else level[i] for i in range(0, len(level), 2)])
+
+    @property
+    def root(self):
+        return self.levels[-1][0]
+
+    @property
+    def ticketCount(self):
+        return self.ends[-1]
+
+    # Position of the range holding the ticket, the same one _findTicketOwner picks
+    def find(self, ticketIndex):
+        if not 0 <= ticketIndex < self.ticketCount:
+            raise ValueError("Ticket {} is out of range, the raffle has {} tickets".format(ticketIndex, self.ticketCount))
+        return bisect_right(self.ends, ticketIndex)
+
+    def proof(self, position):
+        proof = []
+        for level in self.levels[:-1]:
+            sibling = position ^ 1
+            if sibling < len(level):
+                proof.append(level[sibling])
+            position //= 2
+        return proof
+
+    def ticket_proof(self, raffleId, ticketIndex):
+        position = self.find(ticketIndex)
+        owner, start, end = self.ranges[position]
+        return {"raffleId": raffleId, "ticketIndex": ticketIndex, "owner": owner, "start": start, "end": end,
+                "proof": ["0x" + node.hex() for node in self.proof(position)]}
+
+# Checks a proof from ticket_proof off-chain, root is the hex string of the root
+def verify_proof(root, ticketProof):
+    if not ticketProof["start"] <= ticketProof["ticketIndex"] < ticketProof["end"]:
+        return False
+    node = leaf_hash(ticketProof["owner"], ticketProof["start"], ticketProof["end"])
+    for sibling in ticketProof["proof"]:
+        node = hash_pair(node, bytes.fromhex(sibling[2:]))
+    return "0x" + node.hex() == root
+
+# Reads the ticket ranges from the contract a page at a time and builds the tree
+def build_tree(raffleId, raffle = None, pageSize = 500):
+    raffle = raffle if raffle else get_raffle()
+    return TicketTree([(row["owner"], row["firstTicket"], row["lastTicket"] + 1) for row in iter_ticket_ranges(raffle, raffleId, pageSize=pageSize)])
+
+def snapshot_path(raffleId):
+    return os.path.join(REPORT_DIR, "ticket_snapshot_{}.json".format(raffleId))
+
+# The snapshot keeps the owner and end of every range, enough to rebuild the tree and make proofs without the chain
+def write_snapshot(tree, raffleId, path = None):
+    path = path if path else snapshot_path(raffleId)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"raffleId": raffleId, "root": "0x" + tree.root.hex(), "ticketCount": tree.ticketCount,
+                   "ranges": [[owner, end] for owner, start, end in tree.ranges]}, f)
+    return path
+
+def read_snapshot(path):
+    with open(path) as f:
+        snapshot = json.load(f)
+    starts = [0] + [end for owner, end in snapshot["ranges"][:-1]]
+    tree = TicketTree([(owner, start, end) for start, (owner, end) in zip(starts, snapshot["ranges"])])
+    if "0x" + tree.root.hex() != snapshot["root"]:
+        raise ValueError("The snapshot at {} doesn't match its root".format(path))
+    return tree
+
+def publish_root(raffleId, tree, account = None, raffle = None):
+    account = account if account else get_account(id="test1")
+    raffle = raffle if raffle else get_raffle()
+    rootTx = raffle.SetTicketRoot(raffleId, tree.root, {'from': account})
+    rootTx.wait(1)
+    return rootTx
+
+def main(raffleId, path = None):
+    raffleId = int(raffleId)
+    tree = build_tree(raffleId)
+    path = write_snapshot(tree, raffleId, path)
+    print("Raffle", raffleId, "root", "0x" + tree.root.hex(), "over", len(tree.ranges), "ranges and", tree.ticketCount, "tickets, written to", path)
+
+def publish(raffleId, path = None):
+    raffleId = int(raffleId)
+    tree = read_snapshot(path) if path else build_tree(raffleId)
+    publish_root(raffleId, tree)
+    print("Stored the ticket root", "0x" + tree.root.hex(), "of raffle", raffleId)
+
+# Prints the proof of a ticket and checks it against the stored root when there is one
+def prove(raffleId, ticketIndex, path = None):
+    raffleId = int(raffleId)
+    tree = read_snapshot(path) if path else build_tree(raffleId)
+    ticketProof = tree.ticket_proof(raffleId, int(ticketIndex))
+    print(json.dumps(ticketProof))
+    raffle = get_raffle()
+    storedRoot = raffle.ticketRoots(raffleId)
+    if int.from_bytes(bytes(storedRoot), "big") == 0:
+        print("No root stored for raffle", raffleId, "yet, the proof checks against the snapshot root:", verify_proof("0x" + tree.root.hex(), ticketProof))
+        return ticketProof
+    valid = raffle.VerifyTicketProof(raffleId, ticketProof["ticketIndex"], ticketProof["owner"], ticketProof["start"], ticketProof["end"], ticketProof["proof"])
+    print("The stored root", "0x" + bytes(storedRoot).hex(), "accepts the proof:", valid)
+    return ticketProof
@@ -0,0 +1,160 @@
+from brownie import web3
+from brownie.network.account import LocalAccount
+from web3.exceptions import TimeExhausted, TransactionNotFound
+from concurrent.futures import Future, ThreadPoolExecutor, wait as wait_futures
+from collections import namedtuple
+import threading
+
+# Sends transactions from many accounts at once without waiting on each receipt
+# Every account keeps its nonce locally, so sends from one account stay in order while different accounts go in parallel
+# Receipts are collected on their own threads, and dropped or underpriced transactions are resent with a higher gas price
+
+PipelineResult = namedtuple("PipelineResult", ["account", "nonce", "txHash", "receipt", "attempts"])
+
+class NonceManager:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._nonces = {}
+        self._locks = {}
+
+    def lock_for(self, address):
+        with self._lock:
+            return self._locks.setdefault(address, threading.Lock())
+
+    # Only called while holding the account's lock
+    def next(self, address):
+        if address not in self._nonces:
+            self._nonces[address] = web3.eth.get_transaction_count(address, "pending")
+        return self._nonces[address]
+
+    def advance(self, address):
+        self._nonces[address] += 1
+
+    def resync(self, address):
+        self._nonces[address] = web3.eth.get_transaction_count(address, "pending")
+
+class TxPipeline:
+    def __init__(self, senders=16, confirmers=16, gas_price=None, gas_bump=1.125, max_retries=3, receipt_timeout=60):
+        self.nonces = NonceManager()
+        self.gas_price = gas_price
+        self.gas_bump = gas_bump
+        self.max_retries = max_retries
+        self.receipt_timeout = receipt_timeout
+        self._send_pool = ThreadPoolExecutor(max_workers=senders)
+        self._confirm_pool = ThreadPoolExecutor(max_workers=confirmers)
+        self._futures = []
+
+    # Queues a contract transaction, ex: pipeline.submit(account, raffle.BuyTickets, raffleId, 3, value=price)
+    def submit(self, account, method, *args, value=0, gas=None):
+        tx = {"to": method._address, "data": method.encode_input(*args), "value": int(value)}
+        if gas is not None:
+            tx["gas"] = gas
+        return self.submit_tx(account, tx)
+
+    # Queues a raw transaction dict (to, data, value and optionally gas), returns a Future of the PipelineResult
+    def submit_tx(self, account, tx):
+        future = Future()
+        self._futures.append(future)
+        self._send_pool.submit(self._send, future, account, dict(tx), 1)
+        return future
+
+    # Blocks until every queued transaction is confirmed or has failed, returns the results in submission order
+    def wait(self):
+        return [future.result() for future in self._futures]
+
+    # Retries are queued on the send pool from the confirming threads, so every transaction has to settle before it's shut down
+    def close(self):
+        wait_futures(self._futures)
+        self._send_pool.shutdown(wait=True)
+        self._confirm_pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _gas_price(self, attempt):
+        base = self.gas_price if self.gas_price is not None else web3.eth.gas_price
+        return int(base * self.gas_bump ** (attempt - 1))
+
+    # sent holds the hashes already sent with this nonce (a resend of a dropped or underpriced transaction)
+    def _send(self, future, account, tx, attempt, nonce=None, sent=()):
+        try:
+            address = account.address
+            with self.nonces.lock_for(address):
+                # The nonce is only used up once the node accepts the transaction, so a failed send leaves no gap
+                usedNonce = self.nonces.next(address) if nonce is None else nonce
+                txHash = self._broadcast(account, tx, usedNonce, attempt)
+                if nonce is None:
+                    self.nonces.advance(address)
+            self._confirm_pool.submit(self._confirm, future, account, tx, usedNonce, sent + (txHash,), attempt)
+        except ValueError as e:
+            self._retry_or_fail(future, account, tx, nonce, attempt, e, sent)
+        except Exception as e:
+            future.set_exception(e)
+
+    def _broadcast(self, account, tx, nonce, attempt):
+        tx = dict(tx, nonce=nonce, gasPrice=self._gas_price(attempt), chainId=web3.eth.chain_id)
+        tx["from"] = account.address
+        if "gas" not in tx:
+            tx["gas"] = web3.eth.estimate_gas(tx)
+        if isinstance(account, LocalAccount): # Sign it ourselves
+            del tx["from"]
+            signed = web3.eth.account.sign_transaction(tx, account.private_key)
+            return web3.eth.send_raw_transaction(getattr(signed, "raw_transaction", None) or signed.rawTransaction) # rawTransaction before eth-account 0.13
+        return web3.eth.send_transaction(tx) # Unlocked accounts on the local node
+
+    def _retry_or_fail(self, future, account, tx, nonce, attempt, error, sent=()):
+        message = str(error).lower()
+        if "nonce" in message and sent:
+            # The nonce was used while resending, so an earlier send was mined after all, sending again would duplicate it
+            self._settle_sent(future, account, nonce, sent, attempt, error)
+        elif attempt >= self.max_retries:
+            future.set_exception(error)
+        elif "underpriced" in message:
+            # Same nonce with a higher gas price so it can replace the stuck one
+            self._resubmit(future, account, tx, attempt + 1, nonce, sent)
+        elif "nonce" in message:
+            # Someone else used the account, pick the nonce up from the chain again
+            with self.nonces.lock_for(account.address):
+                self.nonces.resync(account.address)
+            self._resubmit(future, account, tx, attempt + 1)
+        else:
+            future.set_exception(error)
+
+    # Fails the transaction instead of leaving its Future unresolved if the send pool has been shut down
+    def _resubmit(self, future, account, tx, attempt, nonce=None, sent=()):
+        try:
+            self._send_pool.submit(self._send, future, account, tx, attempt, nonce, sent)
+        except RuntimeError as e:
+            future.set_exception(e)
+
+    # Settles the transaction with the receipt of whichever earlier send was mined, fails it if none was
+    def _settle_sent(self, future, account, nonce, sent, attempt, error):
+        for txHash in sent:
+            try:
+                receipt = web3.eth.get_transaction_receipt(txHash)
+            except TransactionNotFound:
+                continue
+            future.set_result(PipelineResult(account, nonce, txHash.hex(), receipt, attempt))
+            return
+        future.set_exception(error) # Something else used the nonce
+
+    def _confirm(self, future, account, tx, nonce, sent, attempt):
+        txHash = sent[-1]
+        try:
+            receipt = web3.eth.wait_for_transaction_receipt(txHash, timeout=self.receipt_timeout)
+        except TimeExhausted as e:
+            try:
+                web3.eth.get_transaction(txHash)
+            except TransactionNotFound: # Dropped from the mempool, send it again with the same nonce
+                if attempt < self.max_retries:
+                    self._resubmit(future, account, tx, attempt + 1, nonce, sent)
+                    return
+            future.set_exception(e)
+            return
+        except Exception as e:
+            future.set_exception(e)
+            return
+        future.set_result(PipelineResult(account, nonce, txHash.hex(), receipt, attempt))
@@ -1,21 +1,120 @@
 import os
-import shutil 
+import shutil
 import yaml
 import json
+import hashlib
+import tempfile
 
-def update_front_end():
-    copy_folders_to_front_end("./build", "../../charity-raffle-front-end/src/chain-info")
+FRONT_END = "../../charity-raffle-front-end/src"
+MANIFEST = ".sync-manifest.json" # Hashes of the files last copied into a destination folder
+
+# Only the files that changed are copied, so the front end only reloads what it has to
+# With abi_only the front end gets just the ABIs and deployment maps instead of the full build (bytecode, source maps, ...)
+def update_front_end(abi_only=False):
+    if abi_only:
+        changed = export_abis("./build", FRONT_END + "/chain-info")
+    else:
+        changed = copy_folders_to_front_end("./build", FRONT_END + "/chain-info")
+    print("Updated", len(changed), "front end files.")
     with open("brownie-config.yaml", "r") as f:
         config = yaml.load(f, Loader=yaml.FullLoader)
-        with open("../../charity-raffle-front-end/src/config.json", "w") as f:
-            f.write(json.dumps(config))
+    if write_if_changed(FRONT_END + "/config.json", json.dumps(config).encode()):
         print("Updated front end config.")
 
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+def hash_file(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+# Writes to a temporary file next to the destination and swaps it in, so readers never see a half written file
+def atomic_write(path, data):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    # mkstemp makes the file 0600, give it the permissions a plain open() would
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(tmp, 0o666 & ~umask)
+    os.replace(tmp, path)
+
+def atomic_copy(src, dest):
+    os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dest) or ".")
+    os.close(fd)
+    shutil.copy2(src, tmp)
+    os.replace(tmp, dest)
+
+def write_if_changed(path, data):
+    if os.path.exists(path) and hash_file(path) == hash_bytes(data):
+        return False
+    atomic_write(path, data)
+    return True
+
+def load_manifest(dest):
+    try:
+        with open(os.path.join(dest, MANIFEST)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+# Brings dest in line with files (relative path -> source path or bytes), removes what isn't there anymore
+def sync_files(files, dest):
+    manifest = load_manifest(dest)
+    hashes = {}
+    changed = []
+    for relpath, source in files.items():
+        target = os.path.join(dest, relpath)
+        hashes[relpath] = hash_bytes(source) if isinstance(source, bytes) else hash_file(source)
+        if manifest.get(relpath) == hashes[relpath] and os.path.exists(target):
+            continue
+        if isinstance(source, bytes):
+            atomic_write(target, source)
+        else:
+            atomic_copy(source, target)
+        changed.append(relpath)
+    for relpath in set(manifest) - set(hashes):
+        target = os.path.join(dest, relpath)
+        if os.path.exists(target):
+            os.remove(target)
+        changed.append(relpath)
+    if changed or not os.path.exists(os.path.join(dest, MANIFEST)):
+        atomic_write(os.path.join(dest, MANIFEST), json.dumps(hashes, indent=1, sort_keys=True).encode())
+    return changed
+
 def copy_folders_to_front_end(src, dest):
-    if os.path.exists(dest):
-        shutil.rmtree(dest)
-    shutil.copytree(src, dest)
+    files = {}
+    for root, _, names in os.walk(src):
+        for name in names:
+            path = os.path.join(root, name)
+            files[os.path.relpath(path, src)] = path
+    return sync_files(files, dest)
+
+# Only the ABIs of the contracts and the deployment maps, at the same paths as in the full build
+def export_abis(src, dest):
+    files = {}
+    for folder in ["contracts", "deployments"]:
+        for root, _, names in os.walk(os.path.join(src, folder)):
+            for name in names:
+                path = os.path.join(root, name)
+                if name == "map.json":
+                    files[os.path.relpath(path, src)] = path
+                elif name.endswith(".json"):
+                    files[os.path.relpath(path, src)] = trim_build(path)
+    return sync_files(files, dest)
+
+def trim_build(path):
+    with open(path) as f:
+        build = json.load(f)
+    return json.dumps({"contractName": build.get("contractName"), "abi": build.get("abi", [])}, sort_keys=True).encode()
 
 def main():
     update_front_end()
 
+def abis():
+    update_front_end(abi_only=True)